@@ -0,0 +1,182 @@
+"""
+带时间预算的 agent 执行器：每次运行有墙钟截止时间和最大步数，
+记录每次模型调用和每个工具的耗时，预算快用完时跳过慢的可选工具，并在截止前强制模型给出最终回答
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from langchain_core.messages import ToolMessage
+
+from async_agent import SessionResult, StepRecord
+from bench import percentile
+
+
+@dataclass
+class AgentBudget:
+    """
+    Args:
+        deadline: 一次运行的总时长上限（秒）
+        maxSteps: 模型调用次数上限，最后一次调用不再允许调用工具
+        finalAnswerReserve: 给最终回答预留的时间（秒），观察到的模型耗时更长时按观察值预留
+        optionalTools: 可以跳过的工具名，剩余时间不够它的预计耗时时直接返回跳过
+        toolCosts: {工具名: 预计耗时}，运行中按观察到的耗时更新
+    """
+    deadline: float = 60.0
+    maxSteps: int = 10
+    finalAnswerReserve: float = 5.0
+    optionalTools: frozenset = frozenset()
+    toolCosts: dict = field(default_factory=dict)
+
+
+@dataclass
+class BudgetedResult(SessionResult):
+    # 因为步数或时间用完而强制给出的最终回答
+    forcedFinal: bool = False
+    skippedTools: list[str] = field(default_factory=list)
+
+
+class BudgetedAgentExecutor:
+    """
+    Args:
+        chain: 提示词 | 绑定了工具的模型，输入包含 input、chat_history、agent_scratchpad
+        finalChain: 同样的提示词 | 禁止调用工具（tool_choice="none"）的模型，用来强制给出最终回答
+        tools: 工具列表
+        budget: 时间和步数预算
+        toolTimeouts: {工具名: 超时秒数}，实际超时不会超过剩余预算
+        maxWorkers: 同一轮工具并发执行的线程数
+
+    多个线程可以共用一个执行器同时调用 run，观察到的耗时估计是共享的，更新时加锁
+    """
+
+    # 耗时估计的平滑系数，越大越偏向最近的观察值
+    SMOOTHING = 0.3
+
+    def __init__(self, chain, finalChain, tools: Sequence, budget: Optional[AgentBudget] = None,
+                 toolTimeouts=None, defaultToolTimeout=30, maxWorkers=8):
+        self.chain = chain
+        self.finalChain = finalChain
+        self.toolMap = {tool.name: tool for tool in tools}
+        self.budget = budget or AgentBudget()
+        self.toolTimeouts = toolTimeouts or {}
+        self.defaultToolTimeout = defaultToolTimeout
+        self.toolCosts = dict(self.budget.toolCosts)
+        self.llmCost = 0.0
+        self._costLock = threading.Lock()
+        # 同一轮里模型可能多次调用同一个工具，线程数不按工具个数限制
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+
+    def _observe(self, name: str, elapsed: float):
+        with self._costLock:
+            if name == "llm":
+                self.llmCost = elapsed if not self.llmCost else \
+                    self.llmCost + self.SMOOTHING * (elapsed - self.llmCost)
+                return
+            cost = self.toolCosts.get(name)
+            self.toolCosts[name] = elapsed if cost is None else cost + self.SMOOTHING * (elapsed - cost)
+
+    def _reserve(self) -> float:
+        return max(self.budget.finalAnswerReserve, self.llmCost)
+
+    def run(self, user_input: str, chat_history: Optional[list] = None) -> BudgetedResult:
+        result = BudgetedResult()
+        start = time.perf_counter()
+        deadline = start + self.budget.deadline
+        inputs = {"input": user_input, "chat_history": chat_history or [], "agent_scratchpad": []}
+        skipped_all = False
+        try:
+            for step in range(self.budget.maxSteps):
+                # 这一步之后至少还要留出一次最终回答的时间，否则这一步就是最终回答；
+                # 上一轮的工具全被跳过时，再调用一次模型也只会得到同样的工具调用
+                remaining = deadline - time.perf_counter()
+                final = (step == self.budget.maxSteps - 1 or remaining < self.llmCost + self._reserve()
+                         or skipped_all)
+                step_start = time.perf_counter()
+                response = (self.finalChain if final else self.chain).invoke(inputs)
+                elapsed = time.perf_counter() - step_start
+                self._observe("llm", elapsed)
+                result.steps.append(StepRecord("llm", "final" if final else "model", elapsed))
+                if final or not response.tool_calls:
+                    result.output = response.content
+                    result.forcedFinal = final
+                    break
+                inputs["agent_scratchpad"].append(response)
+                skipped_before = len(result.skippedTools)
+                inputs["agent_scratchpad"].extend(self._run_tools(response.tool_calls, deadline, result))
+                skipped_all = len(result.skippedTools) - skipped_before == len(response.tool_calls)
+        except Exception as e:
+            result.error = repr(e)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _run_tools(self, tool_calls, deadline: float, result: BudgetedResult) -> list[ToolMessage]:
+        """并发执行同一轮的工具，返回的 ToolMessage 与 tool_calls 顺序一致"""
+        # 工具最多运行到给最终回答预留的时间之前
+        tool_deadline = deadline - self._reserve()
+        submitted = []
+        for tool_call in tool_calls:
+            name = tool_call["name"]
+            tool = self.toolMap.get(name)
+            remaining = tool_deadline - time.perf_counter()
+            if tool is None or (name in self.budget.optionalTools and self.toolCosts.get(name, 0.0) > remaining):
+                submitted.append((tool_call, None, 0.0, 0.0))
+                continue
+            timeout = min(self.toolTimeouts.get(name, self.defaultToolTimeout), max(0.0, remaining))
+            submitted.append((tool_call, self.executor.submit(tool.invoke, tool_call["args"]),
+                              time.perf_counter(), time.perf_counter() + timeout))
+
+        tool_messages = []
+        for tool_call, future, step_start, step_deadline in submitted:
+            name = tool_call["name"]
+            error = None
+            if name not in self.toolMap:
+                # 模型调用了不存在的工具，返回错误让模型自己处理，不中断这次运行
+                error = "unknown tool"
+                content = f"工具 {name} 不存在"
+            elif future is None:
+                error = "skipped"
+                result.skippedTools.append(name)
+                content = f"剩余时间不足，跳过工具 {name}"
+            else:
+                try:
+                    content = str(future.result(timeout=max(0.0, step_deadline - time.perf_counter())))
+                except FutureTimeoutError:
+                    # 线程无法被强制中断，超时的工具会在后台继续运行直到结束，结果被丢弃
+                    error = "timeout"
+                    content = f"工具 {name} 执行超时"
+                except Exception as e:
+                    error = repr(e)
+                    content = f"工具 {name} 执行失败: {e}"
+                # 超时的工具至少用了这么久，同样计入预计耗时
+                elapsed = time.perf_counter() - step_start
+                self._observe(name, elapsed)
+            result.steps.append(StepRecord("tool", name, 0.0 if future is None else elapsed, error))
+            tool_messages.append(ToolMessage(content=content, tool_call_id=tool_call["id"],
+                                             status="error" if error else "success"))
+        return tool_messages
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def step_percentiles(results: Sequence[SessionResult]) -> dict[str, dict]:
+    """汇总多次运行里每类步骤的耗时分布（毫秒），用来分析尾延迟来自模型还是哪个工具"""
+    samples: dict[str, list[float]] = {}
+    for result in results:
+        for step in result.steps:
+            if step.error in ("skipped", "unknown tool"):
+                # 没有真正执行的工具不计入耗时分布
+                continue
+            samples.setdefault("llm" if step.kind == "llm" else step.name, []).append(step.elapsed)
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000,
+            "total_ms": sum(values) * 1000,
+        }
+        for name, values in samples.items()
+    }
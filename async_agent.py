@@ -0,0 +1,131 @@
+"""
+异步 agent 运行时：一个事件循环里同时跑大量会话，模型调用走 ainvoke 和共享的异步连接池，
+有原生协程的工具直接 await，只有同步实现的工具放到有上限的线程池里执行，不会阻塞事件循环
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from langchain_core.messages import ToolMessage
+
+
+@dataclass
+class StepRecord:
+    kind: str  # "llm" 或 "tool"
+    name: str
+    elapsed: float
+    error: Optional[str] = None
+    # 等待模型调用名额的时间，不计入 elapsed
+    queued: float = 0.0
+
+
+@dataclass
+class SessionResult:
+    output: str = ""
+    steps: list[StepRecord] = field(default_factory=list)
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def totals(self) -> dict[str, float]:
+        """按步骤汇总耗时：模型调用记在 "llm" 下，工具按工具名"""
+        totals: dict[str, float] = {}
+        for step in self.steps:
+            key = "llm" if step.kind == "llm" else step.name
+            totals[key] = totals.get(key, 0.0) + step.elapsed
+        return totals
+
+
+class AsyncAgentRuntime:
+    """
+    Args:
+        chain: 提示词 | 绑定了工具的模型，输入包含 input、chat_history、agent_scratchpad
+        tools: 工具列表
+        maxSessions: 同时运行的会话数上限，超过的会话排队
+        maxWorkers: 执行同步工具的线程数
+        toolTimeouts: {工具名: 超时秒数}，未配置的工具使用 defaultToolTimeout
+        maxSteps: 每个会话最多调用模型的次数，防止模型一直调用工具
+        maxInFlightCalls: 同时在途的模型调用数，一般设成连接池大小。
+            httpcore 连接池里排队的请求越多，每次分配连接的开销越大，多出来的请求在这里排队
+    """
+
+    def __init__(self, chain, tools: Sequence, maxSessions=1000, maxWorkers=64, toolTimeouts=None,
+                 defaultToolTimeout=30, maxSteps=10, maxInFlightCalls=None):
+        self.chain = chain
+        self.toolMap = {tool.name: tool for tool in tools}
+        self.maxSessions = maxSessions
+        self.toolTimeouts = toolTimeouts or {}
+        self.defaultToolTimeout = defaultToolTimeout
+        self.maxSteps = maxSteps
+        self.maxInFlightCalls = maxInFlightCalls
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        # Semaphore 要在事件循环里创建，第一次运行会话时才初始化
+        self._sessions: Optional[asyncio.Semaphore] = None
+        self._calls: Optional[asyncio.Semaphore] = None
+
+    async def run_session(self, user_input: str, chat_history: Optional[list] = None) -> SessionResult:
+        if self._sessions is None:
+            self._sessions = asyncio.Semaphore(self.maxSessions)
+            self._calls = asyncio.Semaphore(self.maxInFlightCalls or self.maxSessions)
+        async with self._sessions:
+            return await self._run_session(user_input, chat_history or [])
+
+    async def run_many(self, inputs: Sequence[str]) -> list[SessionResult]:
+        return await asyncio.gather(*(self.run_session(user_input) for user_input in inputs))
+
+    async def _run_session(self, user_input: str, chat_history: list) -> SessionResult:
+        result = SessionResult()
+        start = time.perf_counter()
+        agent_scratchpad = []
+        try:
+            for _ in range(self.maxSteps):
+                queue_start = time.perf_counter()
+                async with self._calls:
+                    step_start = time.perf_counter()
+                    response = await self.chain.ainvoke({"input": user_input, "chat_history": chat_history,
+                                                         "agent_scratchpad": agent_scratchpad})
+                result.steps.append(StepRecord("llm", "model", time.perf_counter() - step_start,
+                                               queued=step_start - queue_start))
+                if not response.tool_calls:
+                    result.output = response.content
+                    break
+                agent_scratchpad.append(response)
+                # 同一轮的工具并发执行，结果按调用顺序加入历史
+                agent_scratchpad.extend(await asyncio.gather(
+                    *(self._run_tool(tool_call, result) for tool_call in response.tool_calls)))
+            else:
+                result.error = f"超过最大步数 {self.maxSteps}"
+        except Exception as e:
+            result.error = repr(e)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    async def _run_tool(self, tool_call: dict, result: SessionResult) -> ToolMessage:
+        name = tool_call["name"]
+        start = time.perf_counter()
+        error = None
+        try:
+            tool = self.toolMap[name]
+            if getattr(tool, "coroutine", None) is not None:
+                call = tool.ainvoke(tool_call["args"])
+            else:
+                call = asyncio.get_running_loop().run_in_executor(self.executor, tool.invoke, tool_call["args"])
+            tool_result = await asyncio.wait_for(call, self.toolTimeouts.get(name, self.defaultToolTimeout))
+            message = ToolMessage(content=str(tool_result), tool_call_id=tool_call["id"])
+        except asyncio.TimeoutError:
+            # 线程无法被强制中断，超时的同步工具会在后台继续运行直到结束，结果被丢弃
+            error = "timeout"
+            message = ToolMessage(content=f"工具 {name} 执行超时", tool_call_id=tool_call["id"], status="error")
+        except Exception as e:
+            error = repr(e)
+            message = ToolMessage(content=f"工具 {name} 执行失败: {e}", tool_call_id=tool_call["id"], status="error")
+        result.steps.append(StepRecord("tool", name, time.perf_counter() - start, error))
+        return message
+
+    def close(self):
+        self.executor.shutdown(wait=False)
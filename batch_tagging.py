@@ -0,0 +1,207 @@
+"""
+批量打标签：流式读取 JSONL，把多条短文本打包进一次工具调用（参数是标签对象的数组），
+返回条数或编号对不上时把这一批拆成两半重试，结果逐行写入 JSONL
+
+用法:
+    python batch_tagging.py input.jsonl output.jsonl --batch-size 50 --max-in-flight 8
+输入每行是一个 JSON 对象，--text-key 指定文本字段（默认 text），--id-key 指定编号字段（默认 id，缺省时用行号）
+"""
+import argparse
+import functools
+import json
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Type
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+from concurrent_utils import imap_bounded
+from token_utils import count_tokens
+from tool_schema import bind_tools_cached
+
+SYSTEM_PROMPT = (
+    "Think carefully, and then tag each text as instructed. "
+    "Each input line is a JSON object with an id and a text. "
+    "Return exactly one entry per text and copy its id."
+)
+
+
+@functools.lru_cache(maxsize=None)
+def batch_schema(schema: Type[BaseModel]) -> tuple[Type[BaseModel], Type[BaseModel]]:
+    """由单条标签的 schema 生成 (带 id 的单条 schema, 数组 schema)，数组 schema 作为工具定义"""
+    item = create_model(f"{schema.__name__}Item", __base__=schema,
+                        id=(int, Field(description="id of the text being tagged")))
+    batch = create_model(f"{schema.__name__}Batch", __doc__=f"{schema.__doc__ or ''} Tag every text in the batch.",
+                         tags=(List[item], Field(description="one entry per input text")))
+    return item, batch
+
+
+class BatchStats:
+    def __init__(self):
+        self.texts = 0
+        self.failed = 0
+        self.llmCalls = 0
+        self.splits = 0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self) -> dict:
+        elapsed = self.elapsed or time.perf_counter() - self.start
+        return {
+            "texts": self.texts,
+            "failed": self.failed,
+            "llm_calls": self.llmCalls,
+            "splits": self.splits,
+            "elapsed": elapsed,
+            "texts_per_second": self.texts / elapsed if elapsed else 0.0,
+            "llm_calls_per_1000_texts": self.llmCalls * 1000 / self.texts if self.texts else 0.0,
+        }
+
+
+class BatchTagger:
+    """
+    Args:
+        llm: 聊天模型，需要支持 bind_tools
+        schema: 单条文本的标签 schema，例如 10_tagging_extraction 的 Tagging
+        batchSize: 每次调用最多打包的文本条数
+        maxBatchTokens: 每次调用打包的文本 token 总数上限
+        maxInFlight: 同时在途的调用数
+        counter: 文本 -> token 数，默认使用 tiktoken
+    """
+
+    def __init__(self, llm, schema: Type[BaseModel], batchSize=50, maxBatchTokens=4000, maxInFlight=4,
+                 counter=None):
+        from langchain_core.output_parsers.openai_tools import JsonOutputKeyToolsParser
+        from langchain_core.prompts import ChatPromptTemplate
+
+        self.batchSize = batchSize
+        self.maxBatchTokens = maxBatchTokens
+        self.maxInFlight = maxInFlight
+        self.counter = counter or count_tokens
+        self.fields = list(schema.model_fields)
+        self.itemSchema, batch = batch_schema(schema)
+        prompt = ChatPromptTemplate.from_messages([("system", SYSTEM_PROMPT), ("user", "{input}")])
+        tagging_model = bind_tools_cached(llm, [batch], tool_choice=batch.__name__)
+        self.chain = prompt | tagging_model | JsonOutputKeyToolsParser(key_name=batch.__name__, first_tool_only=True)
+        self.stats = BatchStats()
+
+    def pack(self, records: Iterable[tuple]) -> Iterator[list[tuple]]:
+        """把 (id, text) 按条数和 token 数打包成批，单条超过 token 上限时单独成批"""
+        batch, tokens = [], 0
+        for record in records:
+            record_tokens = self.counter(record[1])
+            if batch and (len(batch) >= self.batchSize or tokens + record_tokens > self.maxBatchTokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(record)
+            tokens += record_tokens
+        if batch:
+            yield batch
+
+    def _call(self, batch: list[tuple]) -> Optional[list[dict]]:
+        """调用一次模型，返回按批内顺序排列的标签；条数、编号或字段不对时返回 None"""
+        lines = "\n".join(json.dumps({"id": i, "text": text}, ensure_ascii=False) for i, (_, text) in enumerate(batch))
+        self.stats.add(llmCalls=1)
+        try:
+            args = self.chain.invoke({"input": lines}) or {}
+            tags = [self.itemSchema.model_validate(tag) for tag in args.get("tags", [])]
+        except (ValidationError, ValueError, TypeError):
+            return None
+        by_id = {tag.id: tag for tag in tags}
+        if len(tags) != len(batch) or set(by_id) != set(range(len(batch))):
+            return None
+        return [by_id[i].model_dump(include=set(self.fields)) for i in range(len(batch))]
+
+    def tag_batch(self, batch: list[tuple]) -> list[dict]:
+        """返回 [{"id": ..., 标签字段...}]，结果对不上时二分重试，单条仍失败时记录 error"""
+        try:
+            tags = self._call(batch)
+        except Exception as e:
+            # 请求本身失败（超时、连接错误……），拆分重试也无济于事，这一批都记为失败；
+            # 拆分后另一半已经成功的结果不受影响
+            return self._failed_rows(batch, e)
+        if tags is not None:
+            return [{"id": record_id, **tag} for (record_id, _), tag in zip(batch, tags)]
+        if len(batch) == 1:
+            return [{"id": batch[0][0], "error": "invalid tagging response"}]
+        self.stats.add(splits=1)
+        middle = len(batch) // 2
+        return self.tag_batch(batch[:middle]) + self.tag_batch(batch[middle:])
+
+    @staticmethod
+    def _failed_rows(batch: list[tuple], error: Exception) -> list[dict]:
+        return [{"id": record_id, "error": str(error) or repr(error)} for record_id, _ in batch]
+
+    def run(self, records: Iterable[tuple]) -> Iterator[dict]:
+        """records 是 (id, text) 的迭代器，按完成顺序 yield 每条文本的结果"""
+        self.stats = BatchStats()
+        # 在途的批次，任务失败时按批内记录逐条输出错误
+        in_flight: dict[int, list[tuple]] = {}
+
+        def batches():
+            for index, batch in enumerate(self.pack(records)):
+                in_flight[index] = batch
+                yield batch
+
+        for index, future in imap_bounded(self.tag_batch, batches(), self.maxInFlight):
+            batch = in_flight.pop(index)
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"第{index}批打标签失败: {e}", file=sys.stderr)
+                rows = self._failed_rows(batch, e)
+            failed = sum(1 for row in rows if "error" in row)
+            self.stats.add(texts=len(rows), failed=failed)
+            yield from rows
+        self.stats.elapsed = time.perf_counter() - self.stats.start
+
+
+def read_jsonl(path: str, textKey="text", idKey="id") -> Iterator[tuple]:
+    """逐行读取，yield (id, text)，跳过空行"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record.get(idKey, line_number), record[textKey]
+
+
+def tag_file(tagger: BatchTagger, inputPath: str, outputPath: str, textKey="text", idKey="id") -> dict:
+    with open(outputPath, "w", encoding="utf-8") as out:
+        for row in tagger.run(read_jsonl(inputPath, textKey, idKey)):
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return tagger.stats.report()
+
+
+def main(argv=None):
+    from launcher import load_lesson
+    from model_registry import get_chat_model
+
+    arg_parser = argparse.ArgumentParser(description="批量给 JSONL 中的文本打 sentiment/language 标签")
+    arg_parser.add_argument("input")
+    arg_parser.add_argument("output")
+    arg_parser.add_argument("--text-key", default="text")
+    arg_parser.add_argument("--id-key", default="id")
+    arg_parser.add_argument("--batch-size", type=int, default=50)
+    arg_parser.add_argument("--max-batch-tokens", type=int, default=4000)
+    arg_parser.add_argument("--max-in-flight", type=int, default=4)
+    args = arg_parser.parse_args(argv)
+
+    tagging = load_lesson("10_tagging_extraction").Tagging
+    tagger = BatchTagger(get_chat_model(temperature=0), tagging, batchSize=args.batch_size,
+                         maxBatchTokens=args.max_batch_tokens, maxInFlight=args.max_in_flight)
+    report = tag_file(tagger, args.input, args.output, args.text_key, args.id_key)
+    print(f"{report['texts']} 条文本（失败 {report['failed']}），耗时 {report['elapsed']:.1f} s，"
+          f"{report['texts_per_second']:.1f} 条/s，每 1000 条 {report['llm_calls_per_1000_texts']:.1f} 次LLM调用，"
+          f"拆分重试 {report['splits']} 次")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+压测结果统计的公共函数
+"""
+import statistics
+import sys
+
+
+def percentile(values, p: float) -> float:
+    """返回 values 的第 p 百分位（p 取 0~100）"""
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    # method="inclusive" 保证结果落在 [min, max] 区间内
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    if p <= 0:
+        return min(values)
+    if p >= 100:
+        return max(values)
+    return cuts[int(p) - 1]
+
+
+def summarize(name: str, latencies, elapsed: float) -> dict:
+    """汇总一组请求的吞吐量和延迟分位数（单位：毫秒），并打印一行结果"""
+    result = {
+        "name": name,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+    print(f"{name:<28} {result['requests']:>6} req  {result['rps']:>9.1f} req/s  "
+          f"p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms")
+    return result
+
+
+def peak_rss_mb() -> float:
+    """当前进程的内存峰值（MB），Windows 上没有 resource 模块时返回 0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上单位是字节，Linux 上是 KB
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
@@ -0,0 +1,157 @@
+"""
+离线基准测试：启动本地模拟服务，驱动各课程中的 LLM 调用链路，
+统计吞吐量、延迟分位数和客户端 CPU 开销，并把结果写成 JSON
+
+用法:
+    python benchmark_suite.py --iterations 50 --concurrency 4 --latency 0.02 --jitter 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+from launcher import load_lesson
+
+from langchain_core.globals import set_llm_cache
+
+from bench import summarize
+from concurrent_utils import imap_bounded
+from config import config
+from mock_server import MockLLMServer
+from model_registry import get_chat_model
+from tool_schema import bind_tools_cached
+
+
+GIFT_JSON = json.dumps({"gift": "True", "delivery_days": "2", "price_value": "slightly more expensive"})
+
+
+def mock_reply(body: dict) -> str:
+    """3_parser 的请求需要能被 PydanticOutputParser 解析的 JSON，其余请求返回普通文本"""
+    last = str((body.get("messages") or [{}])[-1].get("content") or "")
+    if "delivery_days" in last:
+        return GIFT_JSON
+    return "This is a mock reply."
+
+
+def build_scenarios():
+    """场景名 -> 无参函数，每次调用完整执行一次对应的链路"""
+    http_client = load_lesson("1_http_llm_clinet")
+    parser_lesson = load_lesson("3_parser")
+    chain_lesson = load_lesson("5_chain")
+    lecl_lesson = load_lesson("8_lecl")
+    function_lesson = load_lesson("9_langchain_function_call")
+    extraction_lesson = load_lesson("10_tagging_extraction")
+    agent_lesson = load_lesson("12_complete_agent")
+    agent_lesson.set_wikipedia_backend(agent_lesson.LocalCorpusBackend({"mock": "mock summary"}))
+
+    messages = [{'role': 'user', 'content': 'Translate the text into American English.'}]
+    client = http_client.LLMClient()
+    stream_client = http_client.LLMClient(stream=True)
+    weather_model = bind_tools_cached(get_chat_model(temperature=0), [function_lesson.WeatherSearch])
+
+    def stream_tool_call():
+        # 流式返回的工具调用参数分散在多个数据块里，合并后才是完整的调用
+        message = None
+        for chunk in weather_model.stream("大连天气怎么样?"):
+            message = chunk if message is None else message + chunk
+        if message is None or not message.tool_calls:
+            raise ValueError("流式响应里没有工具调用")
+
+    return {
+        "llm_client.chat": lambda: client.chat(messages),
+        "llm_client.chat_stream": lambda: stream_client.get_text_content_stream(stream_client.chat_stream(messages)),
+        "3_parser.testParser": parser_lesson.testParser,
+        "3_parser.testStreamingParser": parser_lesson.testStreamingParser,
+        "5_chain.single_seq_chain": chain_lesson.single_seq_chain_test,
+        "5_chain.llm_route_chain": chain_lesson.llm_route_chain_test,
+        "8_lecl.simple_lecl": lecl_lesson.simple_lecl_test,
+        "9_function_call.stream_tool_call": stream_tool_call,
+        "10_extraction.tagging": extraction_lesson.tagging_test,
+        "10_extraction.extraction": extraction_lesson.extraction_test,
+        "12_agent.chat_agent": agent_lesson.chat_agent,
+    }
+
+
+def run_scenario(name: str, func, iterations: int, concurrency: int, mock: MockLLMServer) -> dict:
+    def timed_call(_):
+        # thread_time 只统计当前线程的 CPU 时间，不包含同进程里模拟服务线程的开销
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start, time.thread_time() - cpu_start
+
+    timed_call(None)  # 预热：加载模块、建立连接
+    requests_before = mock.requestCount
+    latencies, cpu_times, errors = [], [], 0
+    start = time.perf_counter()
+    for _, future in imap_bounded(timed_call, range(iterations), concurrency):
+        try:
+            latency, cpu_time = future.result()
+        except Exception as e:
+            errors += 1
+            print(f"{name} 执行失败: {e}", file=sys.stderr)
+            continue
+        latencies.append(latency)
+        cpu_times.append(cpu_time)
+    elapsed = time.perf_counter() - start
+
+    result = summarize(name, latencies, elapsed)
+    result.update({
+        "errors": errors,
+        "llm_calls_per_iteration": (mock.requestCount - requests_before) / iterations,
+        "cpu_ms_per_iteration": sum(cpu_times) / max(len(cpu_times), 1) * 1000,
+    })
+    return result
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="lanchain 离线基准测试")
+    arg_parser.add_argument("--iterations", type=int, default=50)
+    arg_parser.add_argument("--concurrency", type=int, default=1)
+    arg_parser.add_argument("--latency", type=float, default=0.02, help="模拟服务的基础延迟（秒）")
+    arg_parser.add_argument("--jitter", type=float, default=0.01, help="在基础延迟上叠加的随机延迟（秒）")
+    arg_parser.add_argument("--token-delay", type=float, default=0.002, help="流式响应相邻数据块的间隔（秒）")
+    arg_parser.add_argument("--only", nargs="*", help="只运行名称包含这些关键字的场景")
+    arg_parser.add_argument("--output", default="bench_results.json")
+    args = arg_parser.parse_args(argv)
+
+    # 基准测试要统计真实的请求，关闭响应缓存
+    set_llm_cache(None)
+    base_url = config["baseUrl"]
+    with MockLLMServer(latency=args.latency, jitter=args.jitter, tokenDelay=args.token_delay,
+                       reply=mock_reply) as mock:
+        # 课程函数内部读取 config["baseUrl"]，只能临时改掉，结束后恢复
+        config["baseUrl"] = mock.baseUrl
+        try:
+            results = []
+            # 课程函数会打印大量内容，压测时丢弃
+            with contextlib.redirect_stdout(io.StringIO()):
+                scenarios = build_scenarios()
+            for name, func in scenarios.items():
+                if args.only and not any(keyword in name for keyword in args.only):
+                    continue
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = run_scenario(name, func, args.iterations, args.concurrency, mock)
+                print(f"{name:<32} {result['requests']:>6} req  {result['rps']:>9.1f} req/s  "
+                      f"p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                      f"cpu {result['cpu_ms_per_iteration']:>7.2f} ms  llm calls {result['llm_calls_per_iteration']:.2f}")
+                results.append(result)
+        finally:
+            config["baseUrl"] = base_url
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+有上限的并发执行：输入可以是惰性的迭代器，同时在途的任务不超过 maxInFlight 个
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, Optional
+
+
+def imap_bounded(func: Callable, items: Iterable, maxInFlight: int,
+                 executor: Optional[ThreadPoolExecutor] = None) -> Iterator[tuple[int, Future]]:
+    """
+    对 items 中的每一项并发执行 func，按完成顺序 yield (输入下标, 已完成的 Future)
+
+    调用方通过 future.result() 取结果或异常，单个任务失败不会影响其他任务。
+    没有传 executor 时创建一个 maxInFlight 个线程的临时线程池。
+    """
+    own_executor = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=maxInFlight)
+    try:
+        pending: dict[Future, int] = {}
+        for index, item in enumerate(items):
+            if len(pending) >= maxInFlight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+            pending[executor.submit(func, item)] = index
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
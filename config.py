@@ -5,4 +5,15 @@ config = {
     "baseUrl": "http://localhost/llmproxy",
     "model": "deepseek-v3-local-II",
     "apiKey": "test",
+    # 模型的上下文窗口大小（token）
+    "contextTokens": 64000,
+    # LLMClient 每个host的连接池大小
+    "poolSize": 10,
+    # 请求超时时间（秒）
+    "timeout": 60,
+    # 响应缓存的磁盘目录和大小上限（字节）
+    "cacheDir": ".llm_cache",
+    "cacheMaxBytes": 100 * 1024 * 1024,
+    # 会话历史 SQLite 数据库文件
+    "historyDb": "chat_history.db",
 }
@@ -0,0 +1,162 @@
+"""
+本地文档库：从目录中读取 HTML/文本文件，通过 mmap 分块读取、增量解码，
+HTML 边解析边转换成文本，产生的文本块可以直接交给分割器，任何时候都不需要把整篇文档放进内存
+"""
+import codecs
+import html
+import mmap
+import os
+import re
+from typing import Iterable, Iterator
+
+HTML_SUFFIXES = (".html", ".htm")
+TEXT_SUFFIXES = (".txt", ".md")
+
+# 这些标签的内容不是正文
+_SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "head"}
+# 块级标签前后断开成段落，分割器会优先在段落边界切分
+_BLOCK_TAGS = {"p", "div", "section", "article", "header", "footer", "main", "aside", "nav", "br", "hr",
+               "li", "ul", "ol", "table", "tr", "td", "th", "pre", "blockquote", "figure", "figcaption",
+               "h1", "h2", "h3", "h4", "h5", "h6", "body"}
+# 注释、不是正文的标签区域，以及自闭合的这类标签
+_SKIP_REGION = re.compile(r"<!--.*?-->|<(%s)\b[^>]*/>|<(%s)\b[^>]*>.*?</\2\s*>"
+                          % ("|".join(_SKIP_TAGS), "|".join(_SKIP_TAGS)), re.IGNORECASE | re.DOTALL)
+_SKIP_START = re.compile(r"<!--|<(?:%s)\b" % "|".join(_SKIP_TAGS), re.IGNORECASE)
+_BLOCK_TAG = re.compile(r"</?(?:%s)\b[^>]*>" % "|".join(_BLOCK_TAGS), re.IGNORECASE)
+_ANY_TAG = re.compile(r"<[a-zA-Z/!?][^>]*>")
+_TAG_START = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ/!?")
+# 没有闭合的 script/注释最多保留这么多字符
+_MAX_HOLD = 1024 * 1024
+# 段落断开的占位符，连续的断开和周围的空格合并成一个
+_BREAK = "\x00"
+_BREAKS = re.compile(r"\x00{2,}")
+
+
+def _collapse_spaces(text: str) -> str:
+    """连续空白合并成一个空格，段落断开和周围的空格、相邻的断开合并成一个断开"""
+    if not text:
+        return text
+    lead = " " if text[0].isspace() else ""
+    trail = " " if text[-1].isspace() else ""
+    text = lead + " ".join(text.split()) + trail if text.strip() else " "
+    text = text.replace(" " + _BREAK, _BREAK).replace(_BREAK + " ", _BREAK)
+    return _BREAKS.sub(_BREAK, text)
+
+
+class StreamingHTMLText:
+    """
+    增量把 HTML 转成纯文本：feed 一段 HTML，drain 取出目前为止产生的文本。
+    每次 feed 用几次整段的正则替换去掉 script/注释等区域和标签，
+    末尾不完整的标签、区域或字符实体留到下一次 feed 再处理
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # 文本片段，段落断开用 _BREAK 占位
+        self._parts: list[str] = []
+        # 上一次 drain 末尾的空格或段落断开先不输出，跨 drain 的连续空白也只保留一个
+        self._pending = ""
+        self._started = False
+
+    def feed(self, data: str):
+        buffer = self._buffer + data
+        # 最后一个 "<" 之后没有 ">"，说明标签还没读完整
+        cut = len(buffer)
+        lt = buffer.rfind("<")
+        if lt >= 0 and buffer.find(">", lt) < 0 and (lt + 1 == len(buffer) or buffer[lt + 1] in _TAG_START):
+            cut = lt
+        text = _SKIP_REGION.sub("", buffer[:cut])
+        hold = buffer[cut:]
+        # 去掉完整的区域后还剩区域开头，说明它的结束标记还没读到
+        match = _SKIP_START.search(text)
+        if match is not None:
+            hold = text[match.start():] + hold
+            text = text[:match.start()]
+            if len(hold) > _MAX_HOLD:
+                # 没有闭合的 script/注释，丢弃它的内容
+                hold = ""
+        elif not hold:
+            # 末尾可能是不完整的字符实体（例如 "&am"）
+            amp = text.rfind("&")
+            if amp >= 0 and len(text) - amp < 32 and ";" not in text[amp:]:
+                text, hold = text[:amp], text[amp:]
+        self._buffer = hold
+        text = _ANY_TAG.sub("", _BLOCK_TAG.sub(_BREAK, text))
+        if text:
+            self._parts.append(text)
+
+    def close(self):
+        if self._buffer and not _SKIP_START.match(self._buffer):
+            self._parts.append(_ANY_TAG.sub("", self._buffer))
+        self._buffer = ""
+
+    def drain(self) -> str:
+        text = self._pending + "".join(self._parts)
+        self._parts = []
+        if "&" in text:
+            text = html.unescape(text)
+        text = _collapse_spaces(text)
+        if not self._started:
+            text = text.lstrip(" " + _BREAK)
+        # 末尾的空白要和下一段文本的开头一起合并
+        self._pending = ""
+        if text[-1:] in (" ", _BREAK):
+            self._pending = text[-1]
+            text = text[:-1]
+        if text:
+            self._started = True
+        return text.replace(_BREAK, "\n\n")
+
+
+def iter_file_blocks(path: str, blockSize: int = 64 * 1024) -> Iterator[str]:
+    """用 mmap 每次读取 blockSize 字节并增量解码成文本，HTML 文件同时转换成纯文本"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = StreamingHTMLText() if path.lower().endswith(HTML_SUFFIXES) else None
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, size, blockSize):
+                text = decoder.decode(mm[start:start + blockSize], final=start + blockSize >= size)
+                if parser is None:
+                    if text:
+                        yield text
+                    continue
+                parser.feed(text)
+                text = parser.drain()
+                if text:
+                    yield text
+    if parser is not None:
+        parser.close()
+        text = parser.drain()
+        if text:
+            yield text
+
+
+class LocalDocumentStore:
+    """
+    Args:
+        root: 文档目录，递归查找其中的 HTML/文本文件
+        blockSize: 每次从文件读取的字节数
+    """
+
+    def __init__(self, root: str, blockSize: int = 64 * 1024, suffixes: Iterable[str] = HTML_SUFFIXES + TEXT_SUFFIXES):
+        self.root = root
+        self.blockSize = blockSize
+        self.suffixes = tuple(suffixes)
+
+    def paths(self) -> Iterator[str]:
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(self.suffixes):
+                    yield os.path.join(directory, filename)
+
+    def iter_blocks(self, path: str) -> Iterator[str]:
+        return iter_file_blocks(path, self.blockSize)
+
+    def iter_documents(self) -> Iterator[tuple[str, Iterator[str]]]:
+        """yield (文件路径, 文本块迭代器)，需要在取下一篇文档前消费完当前的迭代器"""
+        for path in self.paths():
+            yield path, self.iter_blocks(path)
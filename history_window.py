@@ -0,0 +1,165 @@
+"""
+按 token 预算裁剪会话历史：每个会话维护消息 token 数的前缀和，新消息只统计一次，
+每轮用二分查找选出能放进预算的最新消息，更早的消息可以折叠进滚动摘要
+"""
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from token_utils import count_tokens
+
+# OpenAI 的计数规则里每条消息还有角色等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def llm_summarizer(llm) -> Callable[[Sequence[BaseMessage], str], str]:
+    """用 llm 把更早的对话和已有摘要合并成新的摘要"""
+    prompt = ChatPromptTemplate.from_template(
+        "请把已有摘要和新的对话合并成一段简洁的摘要，保留人名、数字等关键信息。\n\n"
+        "已有摘要：{summary}\n\n新的对话：\n{conversation}\n\n新的摘要："
+    )
+    chain = prompt | llm | StrOutputParser()
+
+    def summarize(messages: Sequence[BaseMessage], summary: str) -> str:
+        return chain.invoke({"summary": summary or "无", "conversation": get_buffer_string(messages)})
+    return summarize
+
+
+class _SessionWindow:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # prefix[i] 是前 i 条消息的 token 总数
+        self.prefix = [0]
+        self.summary = ""
+        self.summaryTokens = 0
+        # 摘要已经覆盖了前 summarizedUpto 条消息
+        self.summarizedUpto = 0
+
+
+class HistoryWindow:
+    """
+    包装 get_session_history，让 RunnableWithMessageHistory 只注入预算内的历史
+
+    Args:
+        maxTokens: 注入提示词的历史 token 上限（包括摘要）
+        summarizer: 可选，(更早的消息, 已有摘要) -> 新摘要；不传时直接丢弃窗口外的消息
+        summaryReserve: 开启摘要时摘要最多占用的 token 数，超出的部分被截断
+        counter: 文本 -> token 数，默认使用 tiktoken
+        maxSessions: 最多保留多少个会话的计数状态
+
+    最新一轮的用户消息总会保留，只有它本身就超过 maxTokens 时窗口才会超出预算
+    """
+
+    def __init__(self, maxTokens=2000, summarizer=None, summaryReserve=300, counter=None, maxSessions=10_000):
+        self.maxTokens = maxTokens
+        self.summarizer = summarizer
+        self.summaryReserve = summaryReserve if summarizer else 0
+        self.counter = counter or count_tokens
+        self.maxSessions = maxSessions
+        self._sessions: OrderedDict[str, _SessionWindow] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def wrap(self, get_session_history: Callable[[str], BaseChatMessageHistory]):
+        def get_windowed_history(session_id: str) -> "WindowedChatMessageHistory":
+            return WindowedChatMessageHistory(get_session_history(session_id), self._state(session_id), self)
+        return get_windowed_history
+
+    def _state(self, session_id: str) -> _SessionWindow:
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = self._sessions[session_id] = _SessionWindow()
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.maxSessions:
+                self._sessions.popitem(last=False)
+            return state
+
+    def message_tokens(self, message: BaseMessage) -> int:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        return self.counter(content) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def _summary_message(summary: str) -> SystemMessage:
+        return SystemMessage(content=f"之前对话的摘要：{summary}")
+
+    def _summary_tokens(self, summary: str) -> int:
+        return self.message_tokens(self._summary_message(summary))
+
+    def _cap_summary(self, summary: str) -> str:
+        """把摘要截断到 summaryReserve 以内，二分查找能保留的最长前缀"""
+        if self._summary_tokens(summary) <= self.summaryReserve:
+            return summary
+        lo, hi = 0, len(summary)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._summary_tokens(summary[:mid]) <= self.summaryReserve:
+                lo = mid
+            else:
+                hi = mid - 1
+        return summary[:lo]
+
+    def _fit(self, messages: list[BaseMessage], state: _SessionWindow, reserved: int) -> int:
+        """返回最小的 start，使 messages[start:] 加上 reserved 不超过 maxTokens，且窗口从用户消息开始"""
+        total = state.prefix[-1]
+        # reserved 超过 maxTokens 时 bisect 会返回 len(prefix)，收到 len(messages)
+        start = min(bisect_left(state.prefix, total - (self.maxTokens - reserved)), len(messages))
+        # 窗口从用户消息开始，避免留下没有提问的回答或工具结果
+        while start < len(messages) and not isinstance(messages[start], HumanMessage):
+            start += 1
+        if start == len(messages):
+            # 预算放不下最新一轮时仍然保留最新的用户消息
+            start = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)),
+                         len(messages))
+        return start
+
+    def select(self, messages: list[BaseMessage], state: _SessionWindow) -> list[BaseMessage]:
+        with state.lock:
+            if len(messages) < len(state.prefix) - 1:
+                # 历史被清空过，重新开始计数
+                state.reset()
+            # 只统计新增的消息
+            for message in messages[len(state.prefix) - 1:]:
+                state.prefix.append(state.prefix[-1] + self.message_tokens(message))
+
+            # 摘要不超过 summaryReserve，按预留的大小确定窗口后，窗口外的消息全部并入摘要
+            start = self._fit(messages, state, self.summaryReserve)
+            if self.summarizer and start > state.summarizedUpto:
+                summary = self.summarizer(messages[state.summarizedUpto:start], state.summary)
+                state.summary = self._cap_summary(summary)
+                state.summaryTokens = self._summary_tokens(state.summary) if state.summary else 0
+                state.summarizedUpto = start
+
+            window = messages[start:]
+            if state.summary:
+                window = [self._summary_message(state.summary)] + window
+            return window
+
+
+class WindowedChatMessageHistory(BaseChatMessageHistory):
+    """读取时返回预算内的窗口，写入时原样交给底层历史"""
+
+    def __init__(self, history: BaseChatMessageHistory, state: _SessionWindow, window: HistoryWindow):
+        self.history = history
+        self._state = state
+        self._window = window
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self._window.select(self.history.messages, self._state)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.history.add_messages(messages)
+
+    def clear(self) -> None:
+        self.history.clear()
+        with self._state.lock:
+            self._state.reset()
@@ -0,0 +1,57 @@
+"""
+异步 HTTP 客户端的收尾：httpx.AsyncClient 的连接属于创建它的事件循环，
+换了事件循环或循环已经关闭时不能直接 await aclose()，这里按循环的状态选择关闭方式
+"""
+import asyncio
+import socket
+from typing import Optional
+
+import httpx
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def shutdown_connections(client: httpx.AsyncClient):
+    """
+    所属事件循环已经关闭的客户端无法再 aclose，直接断开连接池里每个连接的 socket。
+    httpx 没有公开这些对象，这里读取 httpcore 的私有字段（_transport._pool、_connection._network_stream），
+    只是尽力而为：字段不存在或结构变了时什么都不做，连接留给垃圾回收关闭
+    """
+    try:
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+    except Exception:
+        return
+    for connection in connections:
+        try:
+            stream = getattr(getattr(connection, "_connection", None), "_network_stream", None)
+            sock = stream.get_extra_info("socket") if stream is not None else None
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            continue
+
+
+def dispose_async_client(client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop) -> bool:
+    """
+    在客户端所属的事件循环里关闭它，循环已经关闭时直接断开连接。
+    循环既没关闭也没运行、当前线程又有别的循环在运行时无法处理，返回 False
+    """
+    if loop.is_closed():
+        shutdown_connections(client)
+        return True
+    if loop.is_running():
+        if loop is _running_loop():
+            loop.create_task(client.aclose())
+        else:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        return True
+    if _running_loop() is None:
+        loop.run_until_complete(client.aclose())
+        return True
+    return False
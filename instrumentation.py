@@ -0,0 +1,264 @@
+"""
+LCEL 链路的耗时和 token 统计：
+- 回调记录每个 runnable 阶段（提示词模板、模型、解析器……）的耗时
+- 模型阶段额外记录 token 数、首个 token 耗时
+- 配合 instrumented_http_clients 的 httpx 钩子，把模型耗时拆成排队等待（组装请求+等连接）和网络耗时
+结果可以导出成 JSON lines 或 Prometheus 文本格式
+"""
+import json
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, asdict
+from typing import Any, Optional
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 当前线程/协程里正在执行的模型阶段，httpx 钩子用它把请求时间记到对应的阶段上
+_current_llm_stage: ContextVar[Optional["StageRecord"]] = ContextVar("current_llm_stage", default=None)
+
+
+@dataclass
+class StageRecord:
+    run_id: str
+    parent_run_id: Optional[str]
+    name: str
+    run_type: str
+    start: float
+    end: float = 0.0
+    error: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    ttft: Optional[float] = None
+    # 以下两个时间点来自 httpx 的 trace 事件
+    request_sent: Optional[float] = None
+    response_headers: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def queue_wait(self) -> Optional[float]:
+        """模型阶段开始到请求头发出：组装请求、等待连接池"""
+        return self.request_sent - self.start if self.request_sent else None
+
+    @property
+    def network(self) -> Optional[float]:
+        """请求头发出到收到响应头：网络往返和服务端处理"""
+        if self.request_sent and self.response_headers:
+            return self.response_headers - self.request_sent
+        return None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.update(duration=self.duration, queue_wait=self.queue_wait, network=self.network)
+        return data
+
+
+class InstrumentationHandler(BaseCallbackHandler):
+    """
+    通过 config={"callbacks": [handler]} 挂到任意链上
+
+    Args:
+        maxRecords: 保留的明细条数，超过后丢弃最早的明细，汇总统计不受影响
+    """
+
+    # 异步调用时 LangChain 默认把同步回调放到线程池里、在复制的上下文中执行，
+    # 设置的 _current_llm_stage 到不了发请求的协程，这里要求在调用方的上下文里直接执行
+    run_inline = True
+
+    def __init__(self, maxRecords=10_000):
+        self.records: deque[StageRecord] = deque(maxlen=maxRecords)
+        self._active: dict[UUID, StageRecord] = {}
+        # 模型阶段设置 _current_llm_stage 时的 token，阶段结束时恢复原值
+        self._stageTokens: dict[UUID, Token] = {}
+        # (run_type, name) -> [次数, 总耗时, 错误次数]
+        self._stages: dict[tuple[str, str], list] = {}
+        # 模型名 -> [prompt tokens, completion tokens, 首token耗时总和, 首token次数, 排队总和, 网络总和, 请求次数]
+        self._models: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    # ---------- 回调 ----------
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs: Any):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs), "chain")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs: Any):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs: Any):
+        record = self._start(run_id, parent_run_id, self._name(serialized, kwargs), "llm")
+        self._stageTokens[run_id] = _current_llm_stage.set(record)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs: Any):
+        record = self._start(run_id, parent_run_id, self._name(serialized, kwargs), "llm")
+        self._stageTokens[run_id] = _current_llm_stage.set(record)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs: Any):
+        record = self._active.get(run_id)
+        if record is not None and record.ttft is None:
+            record.ttft = time.perf_counter() - record.start
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any):
+        record = self._active.get(run_id)
+        if record is not None:
+            record.prompt_tokens, record.completion_tokens = self._token_usage(response)
+        self._reset_stage(run_id)
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs: Any):
+        self._reset_stage(run_id)
+        self._end(run_id, error)
+
+    # ---------- httpx 钩子 ----------
+
+    def on_http_request(self, request: httpx.Request):
+        record = _current_llm_stage.get()
+        if record is None or record.end:
+            return
+
+        def trace(event_name: str, info: dict):
+            self._trace(record, event_name)
+        request.extensions["trace"] = trace
+
+    async def on_async_http_request(self, request: httpx.Request):
+        record = _current_llm_stage.get()
+        if record is None or record.end:
+            return
+
+        async def trace(event_name: str, info: dict):
+            self._trace(record, event_name)
+        request.extensions["trace"] = trace
+
+    # ---------- 导出 ----------
+
+    def to_json_lines(self) -> str:
+        with self._lock:
+            records = list(self.records)
+        return "".join(json.dumps(record.to_dict(), ensure_ascii=False) + "\n" for record in records)
+
+    def export_jsonl(self, path: str):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(self.to_json_lines())
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP lcel_stage_seconds Wall time spent in each runnable stage.",
+            "# TYPE lcel_stage_seconds summary",
+        ]
+        with self._lock:
+            stages = dict(self._stages)
+            models = dict(self._models)
+        for (run_type, name), (count, total, errors) in sorted(stages.items()):
+            labels = f'run_type="{run_type}",stage="{_escape(name)}"'
+            lines.append(f"lcel_stage_seconds_count{{{labels}}} {count}")
+            lines.append(f"lcel_stage_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append("# TYPE lcel_stage_errors_total counter")
+        for (run_type, name), (_, _, errors) in sorted(stages.items()):
+            lines.append(f'lcel_stage_errors_total{{run_type="{run_type}",stage="{_escape(name)}"}} {errors}')
+
+        metrics = [
+            ("lcel_prompt_tokens_total", "counter", 0),
+            ("lcel_completion_tokens_total", "counter", 1),
+            ("lcel_ttft_seconds_sum", "counter", 2),
+            ("lcel_ttft_seconds_count", "counter", 3),
+            ("lcel_queue_wait_seconds_sum", "counter", 4),
+            ("lcel_network_seconds_sum", "counter", 5),
+            ("lcel_http_requests_total", "counter", 6),
+        ]
+        for metric, metric_type, index in metrics:
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for model, values in sorted(models.items()):
+                lines.append(f'{metric}{{model="{_escape(model)}"}} {values[index]}')
+        return "\n".join(lines) + "\n"
+
+    # ---------- 内部 ----------
+
+    @staticmethod
+    def _name(serialized, kwargs) -> str:
+        if kwargs.get("name"):
+            return kwargs["name"]
+        serialized = serialized or {}
+        return serialized.get("name") or (serialized.get("id") or ["unknown"])[-1]
+
+    @staticmethod
+    def _token_usage(response) -> tuple[int, int]:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+    def _reset_stage(self, run_id):
+        """模型阶段结束后，同一上下文里后续的请求不再记到这个阶段上"""
+        token = self._stageTokens.pop(run_id, None)
+        if token is None:
+            return
+        try:
+            _current_llm_stage.reset(token)
+        except ValueError:
+            # 异步调用时 LangChain 用 asyncio.gather 执行结束回调，回调在复制的上下文里运行，
+            # 无法恢复原值；httpx 钩子会忽略已经结束的阶段
+            pass
+
+    def _start(self, run_id, parent_run_id, name: str, run_type: str) -> StageRecord:
+        record = StageRecord(run_id=str(run_id), parent_run_id=str(parent_run_id) if parent_run_id else None,
+                             name=name, run_type=run_type, start=time.perf_counter())
+        self._active[run_id] = record
+        return record
+
+    def _end(self, run_id, error=None):
+        record = self._active.pop(run_id, None)
+        if record is None:
+            return
+        record.end = time.perf_counter()
+        if error is not None:
+            record.error = repr(error)
+        with self._lock:
+            self.records.append(record)
+            stage = self._stages.setdefault((record.run_type, record.name), [0, 0.0, 0])
+            stage[0] += 1
+            stage[1] += record.duration
+            stage[2] += error is not None
+            if record.run_type == "llm":
+                model = self._models.setdefault(record.name, [0, 0, 0.0, 0, 0.0, 0.0, 0])
+                model[0] += record.prompt_tokens
+                model[1] += record.completion_tokens
+                if record.ttft is not None:
+                    model[2] += record.ttft
+                    model[3] += 1
+                if record.network is not None:
+                    model[4] += record.queue_wait
+                    model[5] += record.network
+                    model[6] += 1
+
+    @staticmethod
+    def _trace(record: StageRecord, event_name: str):
+        # 事件名形如 http11.send_request_headers.started / http2.receive_response_headers.complete
+        if event_name.endswith("send_request_headers.started") and record.request_sent is None:
+            record.request_sent = time.perf_counter()
+        elif event_name.endswith("receive_response_headers.complete") and record.response_headers is None:
+            record.response_headers = time.perf_counter()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def instrumented_http_clients(handler: InstrumentationHandler, **kwargs) -> tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    返回挂了 trace 钩子的同步/异步 httpx 客户端，
+    传给 ChatOpenAI(http_client=..., http_async_client=...) 后可以区分排队等待和网络耗时
+    """
+    client = httpx.Client(event_hooks={"request": [handler.on_http_request]}, **kwargs)
+    async_client = httpx.AsyncClient(event_hooks={"request": [handler.on_async_http_request]}, **kwargs)
+    return client, async_client
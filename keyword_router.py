@@ -0,0 +1,112 @@
+"""
+基于 Aho-Corasick 自动机的关键词路由：所有分支的关键词编译进同一个自动机，
+对问题只扫描一遍就能得到每个分支命中的关键词
+"""
+from collections import deque
+from typing import Iterable, Optional, Union
+
+from langchain_core.runnables import Runnable, RunnableLambda
+
+
+class KeywordAutomaton:
+    def __init__(self):
+        # 第 i 个状态的转移表、失败指针、以及到达该状态时命中的 (标签下标, 权重)
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[tuple[int, float]]] = [[]]
+        self._built = False
+
+    def add(self, keyword: str, label: int, weight: float = 1.0):
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((label, weight))
+        self._built = False
+
+    def build(self):
+        """按层次遍历计算失败指针，并把失败链上的命中合并到当前状态"""
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+                queue.append(next_state)
+        self._built = True
+
+    def scan(self, text: str) -> dict[int, float]:
+        """返回每个标签下标命中的权重之和，text 只遍历一次"""
+        if not self._built:
+            self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        scores: dict[int, float] = {}
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for label, weight in output[state]:
+                scores[label] = scores.get(label, 0.0) + weight
+        return scores
+
+
+class KeywordRouter:
+    """
+    关键词路由
+
+    Args:
+        routes: {分支名: 关键词列表 或 {关键词: 权重}}，关键词不区分大小写
+        priority: 可选，{分支名: 优先级}；不传时按 routes 中的顺序，越靠前优先级越高
+        strategy: "score" 选命中权重之和最高的分支，分数相同时比较优先级；
+                  "priority" 选命中了任意关键词且优先级最高的分支（与 RunnableBranch 的顺序匹配一致）
+    """
+
+    def __init__(self, routes: dict[str, Union[Iterable[str], dict[str, float]]],
+                 priority: Optional[dict[str, float]] = None, strategy: str = "score"):
+        if strategy not in ("score", "priority"):
+            raise ValueError(f"unknown strategy: {strategy}")
+        self.strategy = strategy
+        self.labels = list(routes)
+        priority = priority or {}
+        self._priority = [priority.get(label, -i) for i, label in enumerate(self.labels)]
+        self._automaton = KeywordAutomaton()
+        for index, label in enumerate(self.labels):
+            keywords = routes[label]
+            weighted = keywords.items() if isinstance(keywords, dict) else ((keyword, 1.0) for keyword in keywords)
+            for keyword, weight in weighted:
+                self._automaton.add(keyword.casefold(), index, weight)
+        self._automaton.build()
+
+    def scores(self, query: str) -> dict[str, float]:
+        return {self.labels[index]: score for index, score in self._automaton.scan(query.casefold()).items()}
+
+    def classify(self, query: str) -> Optional[str]:
+        """返回得分最高的分支名，没有命中任何关键词时返回 None"""
+        scores = self._automaton.scan(query.casefold())
+        if not scores:
+            return None
+        if self.strategy == "priority":
+            best = max(scores, key=lambda index: self._priority[index])
+        else:
+            best = max(scores, key=lambda index: (scores[index], self._priority[index]))
+        return self.labels[best]
+
+    def as_runnable(self, chains: dict[str, Runnable], default: Runnable, key: str = "query") -> Runnable:
+        """替代 RunnableBranch：根据 input[key] 选出分支链，并用同一个输入调用它"""
+        def route(input_dict):
+            return chains.get(self.classify(input_dict.get(key, "")), default)
+        return RunnableLambda(route)
@@ -1,13 +1,18 @@
+import json
+import re
 from config import config
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers.openai_tools import JsonOutputToolsParser
 from langchain_core.output_parsers.openai_tools import JsonOutputKeyToolsParser
-from typing import Optional, List
-from langchain_community.document_loaders.web_base import WebBaseLoader
+from typing import Optional, List, Iterable, Iterator
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.runnables.base import RunnableLambda
+from tool_schema import openai_tool, bind_tools_cached
+from concurrent_utils import imap_bounded
+from token_utils import count_tokens, cached_count_tokens
+from instrumentation import InstrumentationHandler
+from llm_cache import ExtractionCache
 
 class Overview(BaseModel):
     """Overview of a section of text."""
@@ -24,22 +29,151 @@ class Info(BaseModel):
     """Information to extract"""
     papers: List[Paper]
 
-def flatten(matrix):
-    flat_list = []
-    for row in matrix:
-        flat_list += row
-    return flat_list
+def iter_text_blocks(text: str, block_size: int = 64 * 1024) -> Iterator[str]:
+    """把长文本按段落边界切成若干块，供 iter_chunks 逐块消费"""
+    start = 0
+    while start < len(text):
+        end = min(start + block_size, len(text))
+        if end < len(text):
+            # 尽量在段落结尾处断开，找不到时直接按长度切
+            boundary = text.rfind("\n\n", start, end)
+            if boundary > start:
+                end = boundary + 2
+        yield text[start:end]
+        start = end
 
-def web_extraction_test():
+def iter_chunks(blocks: Iterable[str], text_splitter: RecursiveCharacterTextSplitter,
+                window: Optional[int] = None) -> Iterator[str]:
+    """
+    惰性地产生分割后的文本块
+
+    每积累到 window 个字符（默认 4 个 chunk_size）的文本就分割一次，最后一个可能不完整的块留到和下一段文本一起分割，
+    内存中只保留当前一段文本，而不是整篇文档的所有分块。
+    """
+    buffer = ""
+    window = window or text_splitter._chunk_size * 4
+    for block in blocks:
+        buffer += block
+        if len(buffer) < window:
+            continue
+        chunks = text_splitter.split_text(buffer)
+        yield from chunks[:-1]
+        if not chunks:
+            buffer = ""
+            continue
+        # 分割器会去掉块两端的空白，直接拼接会把跨块的单词和段落粘在一起，
+        # 所以保留原文中最后一块开始之后的全部内容
+        tail = buffer.rfind(chunks[-1])
+        buffer = buffer[tail:] if tail >= 0 else chunks[-1] + "\n\n"
+    if buffer:
+        yield from text_splitter.split_text(buffer)
+
+def iter_chunks_test(paragraphs=2000, block_size=1000, chunk_size=500):
+    """分块再拼接后单词应该和原文一致：分别测试按长度硬切和按段落切分的文本块"""
+    text = "\n\n".join(" ".join(f"word{i * 10 + j}" for j in range(10)) + " ends here."
+                        for i in range(paragraphs))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+    hard_cut = (text[i:i + block_size] for i in range(0, len(text), block_size))
+    for name, blocks in (("硬切", hard_cut), ("段落", iter_text_blocks(text, block_size))):
+        chunks = list(iter_chunks(blocks, splitter))
+        assert " ".join(chunks).split() == text.split(), f"{name}: 分块后的单词和原文不一致"
+        assert all(len(chunk) <= chunk_size for chunk in chunks), f"{name}: 分块超过 chunk_size"
+        print(f"{name}: {len(chunks)} 块，单词与原文一致")
+
+def extraction_overhead_tokens(prompt: ChatPromptTemplate, tool_schema: dict) -> int:
+    """一次提取请求中分块文本以外的固定 token 数：提示词模板 + 工具定义"""
+    fixed_messages = prompt.format_messages(input="")
+    prompt_tokens = sum(count_tokens(message.content) + 4 for message in fixed_messages)
+    return prompt_tokens + count_tokens(json.dumps(tool_schema, ensure_ascii=False))
+
+def chunk_token_budget(overhead_tokens: int, target_tokens: Optional[int] = None, output_tokens: int = 4096) -> int:
+    """每块的 token 数上限：min(target_tokens, 上下文窗口 - 固定开销 - 输出预留)"""
+    budget = config["contextTokens"] - overhead_tokens - output_tokens
+    if target_tokens:
+        budget = min(budget, target_tokens)
+    return budget
+
+def token_text_splitter(chunk_tokens: int) -> RecursiveCharacterTextSplitter:
+    """
+    按 token 打包分块的分割器，每块不超过 chunk_tokens 个 token（由 chunk_token_budget 计算）。
+    片段的 token 数会被缓存，递归分割时同一片段不会重复分词。
+    """
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_tokens, chunk_overlap=0, length_function=cached_count_tokens)
+
+def token_chunk_window(chunk_tokens: int) -> int:
+    """token 分割器的 chunk_size 单位是 token，换算成 iter_chunks 需要的字符窗口（一个 token 最多约 4 个字符）"""
+    return chunk_tokens * 4 * 4
+
+class PaperIndex:
+    """
+    按规范化后的标题合并重复的论文，每篇论文的作者去重后合并，add 是 O(1) 的。
+    作者只按 ";"、"and"、"&" 拆分，逗号可能是 "Smith, J." 这种姓和名之间的分隔，不能拆
+    """
+
+    def __init__(self):
+        # 规范化标题 -> (第一次出现的标题, {规范化作者: 作者})
+        self._papers: dict[str, tuple[str, dict[str, str]]] = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", text).split()).casefold()
+
+    def add(self, paper: Paper) -> bool:
+        """返回是否是新的论文"""
+        key = self.normalize(paper.title)
+        entry = self._papers.get(key)
+        is_new = entry is None
+        if is_new:
+            entry = self._papers[key] = (paper.title, {})
+        for author in re.split(r"[;&]|\band\b", paper.author or ""):
+            author = " ".join(author.split())
+            if author:
+                entry[1].setdefault(self.normalize(author), author)
+        return is_new
+
+    def __len__(self):
+        return len(self._papers)
+
+    def papers(self) -> list[Paper]:
+        return [Paper(title=title, author="; ".join(authors.values()) or None)
+                for title, authors in self._papers.values()]
+
+def stream_extract(chunks: Iterable[str], extraction_chain, max_in_flight: int = 4,
+                   run_config: Optional[dict] = None, cache: Optional[ExtractionCache] = None,
+                   errors: Optional[list] = None) -> Iterator[Paper]:
+    """
+    同时最多有 max_in_flight 个分块在请求模型，每个分块返回后立即 yield 其中的论文。
+    传了 cache 时先按分块内容查缓存，命中的分块不再请求模型。
+    单个分块失败不影响其他分块：传了 errors 时把 {"chunk": 分块下标, "error": 错误} 追加进去，
+    否则所有分块处理完后抛出异常，避免结果缺了一部分却没人发现
+    """
+    def extract(chunk):
+        tool_calls = cache.get(chunk) if cache else None
+        if tool_calls is None:
+            tool_calls = extraction_chain.invoke({"input": chunk}, config=run_config)
+            if cache:
+                cache.set(chunk, tool_calls)
+        return tool_calls
+
+    failed = errors if errors is not None else []
+    for index, future in imap_bounded(extract, chunks, max_in_flight):
+        try:
+            tool_calls = future.result()
+        except Exception as e:
+            failed.append({"chunk": index, "error": str(e) or repr(e)})
+            continue
+        for tool_call in tool_calls:
+            for paper in tool_call["args"].get("papers", []):
+                yield Paper(title=paper["title"], author=paper.get("author"))
+    if errors is None and failed:
+        raise RuntimeError(f"{len(failed)} 个分块提取失败，第一个: 第{failed[0]['chunk']}个分块 {failed[0]['error']}")
+
+def web_extraction_test(max_in_flight=4, target_tokens=8000):
+    from langchain_community.document_loaders.web_base import WebBaseLoader
     loader = WebBaseLoader("https://lilianweng.github.io/posts/2023-06-23-agent/")
     documents = loader.load()
 
-    model = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    model = get_chat_model(temperature=0)
 
     # prompt = ChatPromptTemplate.from_messages([
     #     ("system", "Extract the relevant information, if not explicitly provided do not guess. Extract partial info"),
@@ -61,19 +195,167 @@ def web_extraction_test():
         ("human", "{input}")
     ])
 
-    extraction_model = model.bind_tools([Info], tool_choice="Info")
+    extraction_model = bind_tools_cached(model, [Info], tool_choice="Info")
     extraction_chain = prompt | extraction_model | JsonOutputToolsParser()
     # response = extraction_chain.invoke({"input": page_content})
     # print(response)
 
     # 文件太大了，我们进行文件分割，并且并行执行
-    text_splitter = RecursiveCharacterTextSplitter(chunk_overlap=0)
-    prep = RunnableLambda(
-        lambda x: [{"input": doc} for doc in text_splitter.split_text(x)]
-    )
-    chain = prep | extraction_chain.map() | flatten
-    response = chain.invoke(documents[0].page_content)
-    print(response)
+    # 按 token 预算打包分块，扣除提示词和工具定义的固定开销，减少调用次数
+    overhead = extraction_overhead_tokens(prompt, openai_tool(Info))
+    chunk_tokens = chunk_token_budget(overhead, target_tokens=target_tokens)
+    text_splitter = token_text_splitter(chunk_tokens)
+    # 分块是惰性产生的，在途请求数有上限，每个分块的结果一返回就合并
+    chunks = iter_chunks(iter_text_blocks(documents[0].page_content), text_splitter,
+                         window=token_chunk_window(chunk_tokens))
+    # 统计每个阶段（提示词、模型、解析器）的耗时和 token 数
+    handler = InstrumentationHandler()
+    # 按分块内容缓存提取结果，重新运行同一篇文档时不再请求模型
+    cache = ExtractionCache(Info, version=f"{model.model_name}\n{template}")
+    # 同一篇论文在多个分块里出现时合并成一条
+    index = PaperIndex()
+    # 失败的分块记录下来，结果不完整时能看到缺了哪些
+    errors = []
+    for paper in stream_extract(chunks, extraction_chain, max_in_flight, run_config={"callbacks": [handler]},
+                                cache=cache, errors=errors):
+        if index.add(paper):
+            print(paper)
+    print(index.papers())
+    for error in errors:
+        print(f"第{error['chunk']}个分块提取失败: {error['error']}")
+    print(handler.prometheus_text())
+    print(f"分块缓存统计: {cache.stats()}")
+
+def local_store_extraction_test(root="docs", max_in_flight=4, target_tokens=8000):
+    """从本地文档目录提取论文，文档以 mmap 分块读取、边解析 HTML 边分割，不会整篇加载到内存"""
+    import time
+    from bench import peak_rss_mb
+    from document_store import LocalDocumentStore
+
+    model = get_chat_model(temperature=0)
+    template = """A article will be passed to you. Extract from it all papers that are mentioned by this article follow by its author. 
+    Do not extract the name of the article itself. If no papers are mentioned that's fine - you don't need to extract any! Just return an empty list.
+    Do not make up or guess ANY extra information. Only extract what exactly is in the text."""
+    prompt = ChatPromptTemplate.from_messages([("system", template), ("human", "{input}")])
+    extraction_chain = prompt | bind_tools_cached(model, [Info], tool_choice="Info") | JsonOutputToolsParser()
+    chunk_tokens = chunk_token_budget(extraction_overhead_tokens(prompt, openai_tool(Info)), target_tokens)
+    text_splitter = token_text_splitter(chunk_tokens)
+    cache = ExtractionCache(Info, version=f"{model.model_name}\n{template}")
+
+    store = LocalDocumentStore(root)
+    index = PaperIndex()
+    documents = 0
+    start = time.perf_counter()
+    for path, blocks in store.iter_documents():
+        chunks = iter_chunks(blocks, text_splitter, window=token_chunk_window(chunk_tokens))
+        for paper in stream_extract(chunks, extraction_chain, max_in_flight, cache=cache):
+            index.add(paper)
+        documents += 1
+    elapsed = time.perf_counter() - start
+    print(index.papers())
+    print(f"{documents} 篇文档，{documents / elapsed:.2f} 篇/s，内存峰值 {peak_rss_mb():.1f} MB")
+
+def local_store_benchmark_test(docs=40, doc_mb=5, chunk_size=4000):
+    """
+    生成 docs 篇、每篇约 doc_mb MB 的 HTML，统计流式读取+转文本+分割的速度和内存峰值，
+    最后再对比一次整篇读入后转换的内存峰值（不请求模型）
+    """
+    import os
+    import tempfile
+    import time
+    from bench import peak_rss_mb
+    from document_store import LocalDocumentStore, StreamingHTMLText
+
+    paragraph = ("<p>Section {i} discusses planning, memory and tool use; see Paper {i} by Author {i}. "
+                 "Agents decompose tasks &amp; reflect on results.</p>\n<script>var x = {i};</script>\n")
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+    with tempfile.TemporaryDirectory() as root:
+        for d in range(docs):
+            with open(os.path.join(root, f"doc_{d:04d}.html"), "w", encoding="utf-8") as f:
+                f.write("<html><head><title>t</title><style>p {}</style></head><body>\n")
+                written, i = 0, 0
+                while written < doc_mb * 1024 * 1024:
+                    written += f.write(paragraph.format(i=i))
+                    i += 1
+                f.write("</body></html>")
+        corpus_mb = sum(os.path.getsize(path) for path in LocalDocumentStore(root).paths()) / 1024 / 1024
+
+        rss_before = peak_rss_mb()
+        chunks = 0
+        start = time.perf_counter()
+        for path, blocks in LocalDocumentStore(root).iter_documents():
+            for _ in iter_chunks(blocks, text_splitter):
+                chunks += 1
+        elapsed = time.perf_counter() - start
+        print(f"流式读取: {docs} 篇共 {corpus_mb:.0f} MB，{chunks} 个分块，{docs / elapsed:.2f} 篇/s，"
+              f"{corpus_mb / elapsed:.1f} MB/s，内存峰值 {peak_rss_mb():.1f} MB（开始时 {rss_before:.1f} MB）")
+
+        path = next(LocalDocumentStore(root).paths())
+        with open(path, encoding="utf-8") as f:
+            parser = StreamingHTMLText()
+            parser.feed(f.read())
+            parser.close()
+            text_splitter.split_text(parser.drain())
+        print(f"整篇读入一篇文档后: 内存峰值 {peak_rss_mb():.1f} MB")
+
+def extraction_rerun_test(paragraphs=400, target_tokens=1000, max_in_flight=4):
+    """
+    在本地模拟服务上重复提取同一篇文档：第一次每个分块都请求模型，原样重新运行不再请求，
+    修改一个词之后只有这个词所在的分块需要重新请求；多个分块里引用的同一篇论文只保留一条
+    """
+    import tempfile
+    from llm_cache import ResponseCache
+    from mock_server import MockLLMServer
+
+    def mock_papers(body):
+        text = body["messages"][-1]["content"]
+        return {"papers": [{"title": title, "author": author}
+                           for title, author in re.findall(r"see (Paper \d+) by (Author \d+)", text)]}
+
+    document = "\n\n".join(f"Section {i} discusses agents in detail, see Paper {i % 50} by Author {i % 50}."
+                             for i in range(paragraphs))
+    edited = document.replace("Section 200 discusses", "Section 200 explains")
+
+    template = "Extract from the article all papers that are mentioned follow by its author."
+    prompt = ChatPromptTemplate.from_messages([("system", template), ("human", "{input}")])
+    with tempfile.TemporaryDirectory() as tmp, MockLLMServer(toolArguments={"Info": mock_papers}) as mock:
+        model = get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False)
+        extraction_chain = prompt | bind_tools_cached(model, [Info], tool_choice="Info") | JsonOutputToolsParser()
+        chunk_tokens = chunk_token_budget(extraction_overhead_tokens(prompt, openai_tool(Info)), target_tokens)
+        text_splitter = token_text_splitter(chunk_tokens)
+        cache = ExtractionCache(Info, version=f"{model.model_name}\n{template}", cache=ResponseCache(cacheDir=tmp))
+
+        for name, text in (("第一次运行", document), ("原样重新运行", document), ("修改一个词后", edited)):
+            calls_before = mock.requestCount
+            chunks = list(iter_chunks(iter_text_blocks(text), text_splitter, window=token_chunk_window(chunk_tokens)))
+            index = PaperIndex()
+            found = 0
+            for paper in stream_extract(chunks, extraction_chain, max_in_flight, cache=cache):
+                found += 1
+                index.add(paper)
+            print(f"{name}: {len(chunks)} 个分块，{mock.requestCount - calls_before} 次LLM调用，"
+                  f"提取到 {found} 条论文，合并后 {len(index)} 篇")
+
+def chunk_sizing_report_test(target_tokens=8000):
+    """对比默认按字符分割和按 token 预算分割时，一篇文档需要的 LLM 调用次数"""
+    from langchain_community.document_loaders.web_base import WebBaseLoader
+    loader = WebBaseLoader("https://lilianweng.github.io/posts/2023-06-23-agent/")
+    text = loader.load()[0].page_content
+
+    template = "A article will be passed to you. Extract from it all papers that are mentioned by this article follow by its author."
+    prompt = ChatPromptTemplate.from_messages([("system", template), ("human", "{input}")])
+    overhead = extraction_overhead_tokens(prompt, openai_tool(Info))
+
+    char_chunks = RecursiveCharacterTextSplitter(chunk_overlap=0).split_text(text)
+    chunk_tokens = chunk_token_budget(overhead, target_tokens=target_tokens)
+    token_chunks = token_text_splitter(chunk_tokens).split_text(text)
+
+    saved = len(char_chunks) - len(token_chunks)
+    print(f"文档长度: {len(text)} 字符, {count_tokens(text)} tokens, 固定开销: {overhead} tokens")
+    print(f"按字符分割: {len(char_chunks)} 次调用")
+    print(f"按token分割（每块≤{chunk_tokens} tokens）: {len(token_chunks)} 次调用")
+    print(f"节省调用: {saved} 次（{saved / max(len(char_chunks), 1):.0%}），"
+          f"节省固定开销: {saved * overhead} tokens")
 
 class Tagging(BaseModel):
     """Tag the piece of text with particular info."""
@@ -82,12 +364,7 @@ class Tagging(BaseModel):
 
 def tagging_test():
     # 1.创建llm
-    model = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    model = get_chat_model(temperature=0)
 
     # 2.创建提示词
     prompt = ChatPromptTemplate.from_messages(([
@@ -96,13 +373,46 @@ def tagging_test():
     ]))
 
     # 3.创建及绑定函数 - 使用 bind_tools 方法，并强制调用该工具
-    tagging_model = model.bind_tools([Tagging], tool_choice="Tagging")
+    tagging_model = bind_tools_cached(model, [Tagging], tool_choice="Tagging")
 
     # 4. 调用模型
     tagging_chain = prompt | tagging_model | JsonOutputToolsParser()
     response = tagging_chain.invoke({"input": "non mi piace questo cibo"})
     print(response)
 
+def batch_tagging_benchmark_test(texts=2000, batch_size=50, max_in_flight=8, drop_rate=0.1, latency=0.05):
+    """
+    在本地模拟服务上对比逐条打标签和批量打标签的吞吐量和调用次数，
+    模拟服务以 drop_rate 的概率少返回一条结果，用来验证拆分重试
+    """
+    import os
+    import random
+    import tempfile
+    from batch_tagging import BatchTagger, tag_file
+    from mock_server import MockLLMServer
+
+    def mock_tags(body):
+        lines = body["messages"][-1]["content"].splitlines()
+        tags = [{"id": json.loads(line)["id"], "sentiment": "neutral", "language": "en"} for line in lines]
+        if len(tags) > 1 and random.random() < drop_rate:
+            tags.pop()
+        return {"tags": tags}
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockLLMServer(latency=latency, toolArguments={"TaggingBatch": mock_tags}) as mock:
+        input_path = os.path.join(tmp, "input.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(texts):
+                f.write(json.dumps({"id": i, "text": f"short review number {i}"}) + "\n")
+
+        model = get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False)
+        for size in (1, batch_size):
+            tagger = BatchTagger(model, Tagging, batchSize=size, maxInFlight=max_in_flight)
+            report = tag_file(tagger, input_path, os.path.join(tmp, f"output_{size}.jsonl"))
+            print(f"每批 {size:>3} 条: {report['texts_per_second']:>8.1f} 条/s，"
+                  f"每 1000 条 {report['llm_calls_per_1000_texts']:>7.1f} 次LLM调用，"
+                  f"拆分重试 {report['splits']} 次，失败 {report['failed']} 条")
+
 class Person(BaseModel):
     """Information about a person."""
     name: str = Field(description="person's name")
@@ -112,19 +422,14 @@ class Information(BaseModel):
     people: List[Person] = Field(description="List of info about people")
 
 def extraction_test():
-    model = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    model = get_chat_model(temperature=0)
 
     prompt = ChatPromptTemplate.from_messages([
         ("system", "Extract the relevant information, if not explicitly provided do not guess. Extract partial info"),
         ("human", "{input}")
     ])
 
-    extraction_model = model.bind_tools([Information], tool_choice="Information")
+    extraction_model = bind_tools_cached(model, [Information], tool_choice="Information")
     extraction_chain = prompt | extraction_model | JsonOutputToolsParser()
     response = extraction_chain.invoke({"input": "Joe is 30, his mom is Martha"})
     print("response:", response)
@@ -142,6 +447,17 @@ def extraction_test():
 
 
 if __name__ == '__main__':
+    from llm_cache import enable_langchain_cache
+
+    # temperature=0 时相同的请求结果一致，开启缓存后重复运行不再请求服务端
+    cache = enable_langchain_cache()
     # tagging_test()
+    # iter_chunks_test()
+    # batch_tagging_benchmark_test()
     # extraction_test()
+    # chunk_sizing_report_test()
+    # extraction_rerun_test()
+    # local_store_extraction_test()
+    # local_store_benchmark_test()
     web_extraction_test()
+    print(f"缓存统计: {cache.stats()}")
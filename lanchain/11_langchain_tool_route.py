@@ -1,24 +1,26 @@
-import requests
 from pydantic import BaseModel, Field
-import datetime
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from config import config
+from model_registry import get_chat_model
+from tool_schema import bind_tools_cached
+from tool_dispatch import ToolDispatcher
+import open_meteo
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.agents import AgentAction, AgentFinish
 from langchain_core.messages import AIMessage
 
 # 自定义解析器：解析 OpenAI 工具调用结果
 def parse_tool_output(message: AIMessage):
-    """解析 AI 消息，返回 AgentAction 或 AgentFinish"""
+    """解析 AI 消息，返回 AgentAction 列表（每个工具调用一个）或 AgentFinish"""
     if message.tool_calls:
-        # 有工具调用
-        tool_call = message.tool_calls[0]
-        return AgentAction(
-            tool=tool_call["name"],
-            tool_input=tool_call["args"],
-            log=str(message)
-        )
+        # 有工具调用，模型可能一次调用多个工具
+        return [
+            AgentAction(
+                tool=tool_call["name"],
+                tool_input=tool_call["args"],
+                log=str(message)
+            )
+            for tool_call in message.tool_calls
+        ]
     else:
         # 没有工具调用，返回最终结果
         return AgentFinish(
@@ -35,52 +37,21 @@ class OpenMeteoInput(BaseModel):
 def get_current_temperature(latitude: float, longitude: float) -> dict:
     """Fetch current temperature for given coordinates."""
 
-    BASE_URL = "https://api.open-meteo.com/v1/forecast"
-
-    # Parameters for the request
-    params = {
-        'latitude': latitude,
-        'longitude': longitude,
-        'hourly': 'temperature_2m',
-        'forecast_days': 1,
-    }
-
-    # Make the request
-    response = requests.get(BASE_URL, params=params)
-
-    if response.status_code == 200:
-        results = response.json()
-    else:
-        raise Exception(f"API Request failed with status code: {response.status_code}")
-
-    current_utc_time = datetime.datetime.utcnow()
-    time_list = [datetime.datetime.fromisoformat(time_str.replace('Z', '+00:00')) for time_str in
-                 results['hourly']['time']]
-    temperature_list = results['hourly']['temperature_2m']
-
-    closest_time_index = min(range(len(time_list)), key=lambda i: abs(time_list[i] - current_utc_time))
-    current_temperature = temperature_list[closest_time_index]
+    # 预报按经纬度网格缓存，附近位置的重复查询不再发请求
+    current_temperature = open_meteo.current_temperature(latitude, longitude)
 
     return f'The current temperature is {current_temperature}°C'
 
 
-def route(result):
-    if isinstance(result, AgentFinish):
-        return result.return_values['output']
-    else:
-        tools = {
-            "get_current_temperature": get_current_temperature,
-        }
-        return tools[result.tool].run(result.tool_input)
+# AgentFinish 返回最终回答的文本；AgentAction 列表返回按调用顺序排列的工具结果列表，
+# 只调用了一个工具也是只有一个元素的列表（以前的 route 只执行第一个工具调用，直接返回它的结果）。
+# 模型调用了不存在的工具时，列表里对应的位置是错误信息，和 12_complete_agent 的执行器一样不会中断。
+# chain.batch 时所有输入的工具调用一起并发执行
+route = ToolDispatcher([get_current_temperature], maxConcurrency=16)
 
 def route_test():
-    model = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
-    route_chain = model.bind_tools([get_current_temperature])
+    model = get_chat_model(temperature=0)
+    route_chain = bind_tools_cached(model, [get_current_temperature])
     prompt = ChatPromptTemplate.from_messages([
         ("system", "You are helpful but sassy assistant"),
         ("user", "{input}"),
@@ -88,9 +59,56 @@ def route_test():
     
     # 使用自定义解析器来解析输出并执行 route
     chain = prompt | route_chain | parse_tool_output | route
+    # 有工具调用时 response 是结果列表，例如 ['The current temperature is 15.2°C']
     # response = chain.invoke({"input": "what is the weather in sf right now"})
     response = chain.invoke({"input": "hi"})
     print(response)
 
+def route_batch_test(inputs=1000, latency=0.02, tool_latency=0.05, max_concurrency=64):
+    """
+    在本地模拟服务上对比逐个执行工具的 route 函数和工具调度器：
+    模拟服务每条回复带两个工具调用，工具用 sleep 模拟网络耗时。
+    模型的回复只生成一次，分别统计单条 invoke 和 batch 全部输入时工具这一步的耗时
+    """
+    import time
+    from langchain_core.runnables import RunnableLambda
+    from langchain_core.tools import StructuredTool
+    from mock_server import MockLLMServer
+
+    def lookup_temperature(latitude: float, longitude: float) -> str:
+        time.sleep(tool_latency)
+        return f'The current temperature is {latitude + longitude:.1f}°C'
+
+    slow_tool = StructuredTool.from_function(lookup_temperature, name="get_current_temperature",
+                                             description="Fetch current temperature for given coordinates.",
+                                             args_schema=OpenMeteoInput)
+
+    def route_one_by_one(result):
+        # 旧写法：每次调用重新建映射，同一条消息里的工具调用逐个执行
+        if isinstance(result, AgentFinish):
+            return result.return_values['output']
+        tools = {"get_current_temperature": slow_tool}
+        return [tools[action.tool].run(action.tool_input) for action in result]
+
+    prompt = ChatPromptTemplate.from_messages([("user", "{input}")])
+    with MockLLMServer(latency=latency, toolArguments={"get_current_temperature": {"latitude": 37.7, "longitude": -122.4}},
+                       toolCallsPerReply=2) as mock:
+        model = bind_tools_cached(get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False), [slow_tool])
+        parsed = (prompt | model | parse_tool_output).batch([{"input": f"weather {i}"} for i in range(inputs)])
+
+    dispatcher = ToolDispatcher([slow_tool], maxConcurrency=max_concurrency)
+    for name, step in (("route 函数", RunnableLambda(route_one_by_one)), ("ToolDispatcher", dispatcher)):
+        start = time.perf_counter()
+        step.invoke(parsed[0])
+        invoke_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        outputs = step.batch(parsed)
+        elapsed = time.perf_counter() - start
+        tool_calls = sum(len(output) for output in outputs)
+        print(f"{name:<16} invoke {invoke_ms:>6.1f} ms，batch {inputs} 个输入 / {tool_calls} 次工具调用 "
+              f"{elapsed:>6.2f} s，{tool_calls / elapsed:>7.1f} 次/s")
+    dispatcher.close()
+
 if __name__ == '__main__':
+    # route_batch_test()
     route_test()
\ No newline at end of file
@@ -1,11 +1,13 @@
-from config import config
+import open_meteo
+from ttl_cache import TTLCache
 
-import requests
 from pydantic import BaseModel, Field
-import datetime
-import wikipedia
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from langchain_openai import ChatOpenAI
+from agent_executor import AgentBudget, BudgetedAgentExecutor, step_percentiles
+from model_registry import get_chat_model
+from tool_schema import bind_tools_cached
 from langchain_core.tools import tool
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
@@ -18,66 +20,122 @@ class OpenMeteoInput(BaseModel):
 def get_current_temperature(latitude: float, longitude: float) -> dict:
     """获取给定坐标的当前温度."""
 
-    BASE_URL = "https://api.open-meteo.com/v1/forecast"
+    # 预报按经纬度网格缓存，附近位置的重复查询不再发请求
+    current_temperature = open_meteo.current_temperature(latitude, longitude)
 
-    # Parameters for the request
-    params = {
-        'latitude': latitude,
-        'longitude': longitude,
-        'hourly': 'temperature_2m',
-        'forecast_days': 1,
-    }
+    return f'当前温度为 {current_temperature}°C'
 
-    # Make the request
-    response = requests.get(BASE_URL, params=params)
+class WikipediaBackend:
+    """
+    维基百科数据源：search 返回页面标题列表，summary 返回页面摘要，
+    页面不存在或是消歧义页时抛出 LookupError。wikipedia 包在第一次查询时才导入
+    """
 
-    if response.status_code == 200:
-        results = response.json()
-    else:
-        raise Exception(f"获取温度数据失败: {response.status_code}")
+    def search(self, query: str) -> list[str]:
+        import wikipedia
+        return wikipedia.search(query)
 
-    current_utc_time = datetime.datetime.utcnow()
-    time_list = [datetime.datetime.fromisoformat(time_str.replace('Z', '+00:00')) for time_str in
-                 results['hourly']['time']]
-    temperature_list = results['hourly']['temperature_2m']
+    def summary(self, title: str) -> str:
+        import wikipedia
+        try:
+            return wikipedia.page(title=title, auto_suggest=False).summary
+        except (wikipedia.exceptions.PageError, wikipedia.exceptions.DisambiguationError) as e:
+            raise LookupError(title) from e
 
-    closest_time_index = min(range(len(time_list)), key=lambda i: abs(time_list[i] - current_utc_time))
-    current_temperature = temperature_list[closest_time_index]
+class LocalCorpusBackend(WikipediaBackend):
+    """本地语料 {标题: 摘要}，测试和压测时替代真实的维基百科，latency 模拟网络耗时"""
 
-    return f'当前温度为 {current_temperature}°C'
+    def __init__(self, corpus: dict[str, str], latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+
+    def search(self, query: str) -> list[str]:
+        time.sleep(self.latency)
+        query = query.casefold()
+        return [title for title, text in self.corpus.items()
+                if query in title.casefold() or query in text.casefold()]
+
+    def summary(self, title: str) -> str:
+        time.sleep(self.latency)
+        if title not in self.corpus:
+            raise LookupError(title)
+        return self.corpus[title]
+
+_wiki_backend: WikipediaBackend = WikipediaBackend()
+# 摘要按规范化后的标题缓存，搜索结果按查询缓存，过期时间单位为秒
+_summary_cache = TTLCache(maxsize=1024, ttl=3600)
+_search_cache = TTLCache(maxsize=256, ttl=600)
+_wiki_executor = ThreadPoolExecutor(max_workers=3)
+
+def set_wikipedia_backend(backend: WikipediaBackend):
+    """切换维基百科数据源，同时清空缓存"""
+    global _wiki_backend
+    _wiki_backend = backend
+    _summary_cache.clear()
+    _search_cache.clear()
+
+def _normalize_title(title: str) -> str:
+    return " ".join(title.replace("_", " ").split()).casefold()
+
+def _fetch_summary(title: str) -> str:
+    key = _normalize_title(title)
+    summary = _summary_cache.get(key)
+    if summary is None:
+        summary = _wiki_backend.summary(title)
+        _summary_cache.set(key, summary)
+    return summary
 
 @tool
 def search_wikipedia(query: str) -> str:
     """运行维基百科搜索并获取页面摘要"""
-    page_titles = wikipedia.search(query)
+    query_key = _normalize_title(query)
+    page_titles = _search_cache.get(query_key)
+    if page_titles is None:
+        page_titles = _wiki_backend.search(query)
+        _search_cache.set(query_key, page_titles)
+
+    # 同时获取多个页面的摘要，已缓存的页面不会再发请求
+    futures = [(page_title, _wiki_executor.submit(_fetch_summary, page_title))
+               for page_title in page_titles[: 3]]
     summaries = []
-    for page_title in page_titles[: 3]:
-            wiki_page =  wikipedia.page(title=page_title, auto_suggest=False)
-            summaries.append(f"标题: {page_title}\n摘要: {wiki_page.summary}")
-            pass
+    for page_title, future in futures:
+        try:
+            summary = future.result()
+        except LookupError:
+            # 页面不存在或是消歧义页，跳过
+            continue
+        summaries.append(f"标题: {page_title}\n摘要: {summary}")
     if not summaries:
         return "在维基百科中没有找到有效信息"
     return "\n\n".join(summaries)
 
+def search_wikipedia_benchmark_test(rounds=5, latency=0.05):
+    """用本地语料对比冷启动和缓存命中时search_wikipedia的耗时"""
+    corpus = {f"李凯 {i}": f"李凯 {i} 的摘要" for i in range(5)}
+    set_wikipedia_backend(LocalCorpusBackend(corpus, latency=latency))
+    for i in range(rounds):
+        start = time.perf_counter()
+        search_wikipedia.invoke({"query": "李凯"})
+        print(f"第{i + 1}次: {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"摘要缓存命中: {_summary_cache.hits}, 未命中: {_summary_cache.misses}")
+    set_wikipedia_backend(WikipediaBackend())
 
-def chat_agent():
-    # 创建llm,并绑定工具
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
-    
-    # 定义工具列表
-    tools = [search_wikipedia, get_current_temperature]
-    
-    # 创建工具名称到工具的映射
-    tool_map = {tool.name: tool for tool in tools}
-    
-    # 绑定工具到llm
-    tool_llm = llm.bind_tools(tools)
 
+# 每个工具的超时时间（秒），未配置的工具使用默认值
+TOOL_TIMEOUTS = {
+    "search_wikipedia": 20,
+    "get_current_temperature": 10,
+}
+DEFAULT_TOOL_TIMEOUT = 30
+
+# 每次运行的时间和步数预算，维基百科搜索慢的时候可以跳过
+AGENT_BUDGET = dict(deadline=60.0, maxSteps=8, finalAnswerReserve=5.0, optionalTools=frozenset({"search_wikipedia"}))
+
+
+AGENT_TOOLS = [search_wikipedia, get_current_temperature]
+
+def build_agent_chain(llm, tool_choice=None):
+    """提示词 | 绑定了工具的模型，同步和异步的 agent 共用，tool_choice="none" 时模型只能直接回答"""
     # 创建提示词模板
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -87,49 +145,153 @@ def chat_agent():
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ]
     )
-    
-    # 创建chain
-    chain = prompt | tool_llm
-    
-    # Agent循环
+    return prompt | bind_tools_cached(llm, AGENT_TOOLS, tool_choice=tool_choice)
+
+
+def build_agent_executor(llm, **budget) -> BudgetedAgentExecutor:
+    """budget 覆盖 AGENT_BUDGET 中的同名配置"""
+    return BudgetedAgentExecutor(build_agent_chain(llm), build_agent_chain(llm, tool_choice="none"), AGENT_TOOLS,
+                                 AgentBudget(**{**AGENT_BUDGET, **budget}), toolTimeouts=TOOL_TIMEOUTS,
+                                 defaultToolTimeout=DEFAULT_TOOL_TIMEOUT)
+
+
+def print_steps(result):
+    for step in result.steps:
+        if step.kind == "llm":
+            print(f"   🤖 {'强制最终回答' if step.name == 'final' else '调用模型'}: {step.elapsed * 1000:.1f} ms")
+        else:
+            print(f"   📍 工具 {step.name}: {step.elapsed * 1000:.1f} ms" + (f" ❌ {step.error}" if step.error else ""))
+
+
+def chat_agent():
+    # 创建llm,并绑定工具
+    executor = build_agent_executor(get_chat_model(temperature=0))
+
+    # Agent循环：最多 maxSteps 次模型调用，截止时间前一定给出最终回答
     user_input = "帮我搜索李凯"
-    chat_history = []
-    agent_scratchpad = []
     print(f"\n🧑 输入: {user_input}")
-    while True:
-        # 调用LLM
-        response = chain.invoke({"input": user_input, "chat_history": chat_history, "agent_scratchpad":agent_scratchpad})
-        
-        # 检查是否有工具调用
-        if response.tool_calls:
-            print(f"\n🤖 模型决定调用工具...")
-            
-            # 将AI的响应添加到历史
-            agent_scratchpad.append(response)
-            
-            # 执行所有工具调用
-            for tool_call in response.tool_calls:
-                tool_name = tool_call["name"]
-                tool_args = tool_call["args"]
-                print(f"   📍 调用工具: {tool_name}")
-                print(f"   📍 参数: {tool_args}")
-                
-                # 执行工具
-                tool_result = tool_map[tool_name].invoke(tool_args)
-                print(f"   ✅ 工具返回: {tool_result}")
-                
-                # 将工具结果添加到历史
-                from langchain_core.messages import ToolMessage
-                tool_message = ToolMessage(
-                    content=str(tool_result),
-                    tool_call_id=tool_call["id"]
-                )
-                agent_scratchpad.append(tool_message)
-        else:
-            # 没有工具调用，直接输出结果
-            print(f"\n🎯 模型最终回答: {response.content}")
-            break
+    try:
+        result = executor.run(user_input)
+    finally:
+        executor.close()
+    print_steps(result)
+    if not result.ok:
+        print(f"\n❌ 运行失败: {result.error}")
+        return
+    print(f"\n🎯 模型最终回答: {result.output}")
+    print(f"耗时 {result.elapsed * 1000:.1f} ms: " + ", ".join(f"{name} {total * 1000:.1f} ms"
+                                                          for name, total in result.totals().items()))
+
+
+def agent_budget_test(runs=5, deadline=2.0, tool_latency=0.3, latency=0.05):
+    """
+    模拟一个一直调用工具的模型：search_wikipedia 每次都很慢，
+    检查预算快用完时会跳过可选工具、在截止时间前强制给出最终回答，并打印各步骤的耗时分布
+    """
+    import random
+    from mock_server import MockLLMServer
+
+    corpus = {f"李凯 {i}": f"李凯 {i} 的摘要" for i in range(1000)}
+    set_wikipedia_backend(LocalCorpusBackend(corpus, latency=tool_latency))
+    query = lambda body: {"query": f"李凯 {random.randrange(len(corpus))}"}
+    try:
+        with MockLLMServer(latency=latency, alwaysCallTools=True, toolArguments={"search_wikipedia": query}) as mock:
+            llm = get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False)
+            executor = build_agent_executor(llm, deadline=deadline, finalAnswerReserve=0.2)
+            try:
+                results = [executor.run("帮我搜索李凯") for _ in range(runs)]
+            finally:
+                executor.close()
+    finally:
+        set_wikipedia_backend(WikipediaBackend())
+
+    for i, result in enumerate(results):
+        print(f"第{i + 1}次: {result.elapsed * 1000:.0f} ms，{len(result.steps)} 步，强制回答 {result.forcedFinal}，"
+              f"跳过工具 {len(result.skippedTools)} 次，超出截止时间 {result.elapsed > deadline}")
+    for name, stats in step_percentiles(results).items():
+        print(f"{name:<20} {stats['count']:>4} 次  p50 {stats['p50_ms']:>8.1f} ms  p99 {stats['p99_ms']:>8.1f} ms  "
+              f"max {stats['max_ms']:>8.1f} ms  total {stats['total_ms']:>8.1f} ms")
+
+
+def async_chat_agent(user_inputs=("帮我搜索李凯", "北京现在多少度")):
+    """在一个事件循环里同时运行多个会话，模型调用走 ainvoke，同步的工具放到线程池里执行"""
+    import asyncio
+    from async_agent import AsyncAgentRuntime
+
+    async def main():
+        runtime = AsyncAgentRuntime(build_agent_chain(get_chat_model(temperature=0)), AGENT_TOOLS,
+                                    toolTimeouts=TOOL_TIMEOUTS, defaultToolTimeout=DEFAULT_TOOL_TIMEOUT)
+        try:
+            results = await runtime.run_many(user_inputs)
+        finally:
+            runtime.close()
+        for user_input, result in zip(user_inputs, results):
+            print(f"\n🧑 输入: {user_input}")
+            for step in result.steps:
+                print(f"   📍 {step.kind} {step.name}: {step.elapsed * 1000:.1f} ms" + (f" ❌ {step.error}" if step.error else ""))
+            print(f"🎯 模型最终回答: {result.output}" if result.ok else f"❌ 会话失败: {result.error}")
+
+    asyncio.run(main())
+
+
+def async_agent_load_test(sessions=2000, max_sessions=1000, latency=0.05, tool_latency=0.02, pool_size=16,
+                          max_workers=64, base_url=None):
+    """
+    在本地模拟服务上压测异步 agent：每个会话先调用一次 search_wikipedia 再得到最终回答，
+    统计每秒完成的会话数，以及模型调用和工具调用各自的延迟分位数。
+    httpcore 分配连接的开销随连接数平方增长，连接池不宜开得过大，会话在模型调用名额上排队即可。
+    进程内的模拟服务和 agent 抢同一个 GIL，压测上限时可以另开进程运行
+    python mock_server.py --latency 0.05，再把 base_url 设成它的地址
+    """
+    import asyncio
+    import random
+    from async_agent import AsyncAgentRuntime
+    from bench import peak_rss_mb, summarize
+    from mock_server import MockLLMServer
+    from model_registry import ModelRegistry
+
+    corpus = {f"李凯 {i}": f"李凯 {i} 的摘要" for i in range(100)}
+    set_wikipedia_backend(LocalCorpusBackend(corpus, latency=tool_latency))
+    query = lambda body: {"query": f"李凯 {random.randrange(len(corpus))}"}
+
+    async def main(baseUrl):
+        # 压测使用单独的注册表，连接池按 pool_size 创建，模型调用的并发数和连接数一致
+        registry = ModelRegistry(poolSize=pool_size)
+        llm = registry.chat_model(baseUrl=baseUrl, temperature=0, cache=False)
+        runtime = AsyncAgentRuntime(build_agent_chain(llm), AGENT_TOOLS, maxSessions=max_sessions,
+                                    maxWorkers=max_workers, toolTimeouts=TOOL_TIMEOUTS,
+                                    defaultToolTimeout=DEFAULT_TOOL_TIMEOUT, maxInFlightCalls=pool_size)
+        start = time.perf_counter()
+        try:
+            results = await runtime.run_many([f"帮我搜索李凯 {i}" for i in range(sessions)])
+        finally:
+            runtime.close()
+            await registry.aclose()
+        elapsed = time.perf_counter() - start
+        return results, elapsed
+
+    if base_url is not None:
+        results, elapsed = asyncio.run(main(base_url))
+    else:
+        with MockLLMServer(latency=latency, toolArguments={"search_wikipedia": query}) as mock:
+            results, elapsed = asyncio.run(main(mock.baseUrl))
+    set_wikipedia_backend(WikipediaBackend())
+
+    steps = [step for result in results for step in result.steps]
+    summarize("session", [result.elapsed for result in results], elapsed)
+    summarize("llm step", [step.elapsed for step in steps if step.kind == "llm"], elapsed)
+    summarize("llm queue", [step.queued for step in steps if step.kind == "llm"], elapsed)
+    summarize("tool step", [step.elapsed for step in steps if step.kind == "tool"], elapsed)
+    failed = [result for result in results if not result.ok]
+    print(f"{len(results)} 个会话，失败 {len(failed)} 个，耗时 {elapsed:.2f} s，"
+          f"{len(results) / elapsed:.1f} 会话/s，内存峰值 {peak_rss_mb():.0f} MB")
+    if failed:
+        print(f"第一个失败原因: {failed[0].error}")
 
 
 if __name__ == '__main__':
+    # search_wikipedia_benchmark_test()
+    # async_chat_agent()
+    # async_agent_load_test()
+    # agent_budget_test()
     chat_agent()
\ No newline at end of file
@@ -1,34 +1,258 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from concurrent_utils import imap_bounded
 from config import config
+from http_utils import dispose_async_client, shutdown_connections
+
+@dataclass
+class ChatResult:
+    """chat_many 中单个请求的结果，index 对应输入列表中的位置"""
+    index: int
+    response: Optional[dict[str, Any]] = None
+    error: Optional[Exception] = None
+    # 单个请求的耗时（秒），不含排队等待
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 class LLMClient:
-    def __init__(self, modeType=None, stream=False):
-        self.baseUrl = config["baseUrl"]
+    def __init__(self, modeType=None, stream=False, baseUrl=None, poolSize=None, timeout=None, cache=None):
+        self.baseUrl = baseUrl or config["baseUrl"]
         self.modelType = modeType or config["model"]
         self.stream = stream
         self.apiKey = config["apiKey"]
+        # 每个host的连接池大小和请求超时（秒）
+        self.poolSize = poolSize or config["poolSize"]
+        self.timeout = timeout or config["timeout"]
         self.headers: dict[str, str] = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.apiKey}'
         }
 
-    def chat(self, messages: list[dict[str, str]]):
-        url = f"{self.baseUrl}/chat/completions"
+        # 复用同一个Session，连接保持keep-alive，避免每次请求重新握手
+        self.session = self._new_session(self.poolSize)
+
+        # 可选的 llm_cache.ResponseCache，命中时不再请求服务端
+        self.cache = cache
+
+        # 最近一次流式请求的首个token耗时（秒）
+        self.lastTtft = None
 
-        payload = {
+        # 异步客户端需要在事件循环内创建，第一次调用achat时再初始化
+        self._asyncClient = None
+        self._asyncLoop = None
+        # 换了事件循环、暂时没法关闭的旧异步客户端，在 close/aclose 时关闭
+        self._staleAsyncClients: list[tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = []
+
+    def _new_session(self, poolSize: int) -> requests.Session:
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_maxsize=poolSize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _build_payload(self, messages: list[dict[str, str]]) -> dict:
+        return {
             "model": self.modelType,
             "messages": messages,
             "stream": self.stream,
             "temperature": 0,
         }
 
+    def chat(self, messages: list[dict[str, str]]):
+        # 始终返回完整的响应；stream=True 时按流式请求再拼回完整响应，需要逐块处理时用 chat_stream
+        if self.stream:
+            return self._collect_stream(self.chat_stream(messages))
+        return self._post(messages)
+
+    def _collect_stream(self, chunks) -> dict:
+        """把 chat.completion.chunk 数据块拼成 chat.completion 格式的响应"""
+        parts, last = [], {}
+        for chunk in chunks:
+            parts.append(self.get_delta_content(chunk))
+            last = chunk
+        choices = last.get('choices') or [{}]
+        return {
+            "id": last.get('id'),
+            "object": "chat.completion",
+            "model": last.get('model', self.modelType),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(parts)},
+                "finish_reason": choices[0].get('finish_reason'),
+            }],
+        }
+
+    def _post(self, messages: list[dict[str, str]], session: Optional[requests.Session] = None):
+        url = f"{self.baseUrl}/chat/completions"
+        payload = self._build_payload(messages)
+        payload["stream"] = False
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.modelType, messages)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = (session or self.session).post(url, json=payload, timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"LLM请求失败: {e}")
+
+        if key is not None:
+            self.cache.set(key, result)
+        return result
+
+    def chat_many(self, messagesList, max_concurrency=None, as_completed=False):
+        """
+        在共享连接池上并发发送多组对话，始终请求完整（非流式）响应
+
+        Args:
+            messagesList: 多组对话消息，每一组相当于一次 chat 的参数
+            max_concurrency: 同时在途的最大请求数，默认等于连接池大小。
+                超过连接池大小时这次调用单独使用一个足够大的连接池，调用结束后关闭
+            as_completed: 为 True 时返回生成器，按完成顺序yield结果
+
+        Returns:
+            与输入顺序一致的 ChatResult 列表；单个请求失败记录在对应的 error 中，不影响其他请求
+        """
+        concurrency = max_concurrency or self.poolSize
+        if as_completed:
+            return self._iter_chat_many(messagesList, concurrency)
+
+        messagesList = list(messagesList)
+        results: list[Optional[ChatResult]] = [None] * len(messagesList)
+        for result in self._iter_chat_many(messagesList, concurrency):
+            results[result.index] = result
+        return results
+
+    def _iter_chat_many(self, messagesList, concurrency: int):
+        # 共享 Session 可能正被其他线程使用，不在调用时改它的连接池；
+        # 并发数超过连接池时多出来的连接用完即丢，又回到每次重新握手，所以这次调用单独建一个连接池
+        session = self._new_session(concurrency) if concurrency > self.poolSize else self.session
+
+        def run(messages):
+            start = time.perf_counter()
+            try:
+                return self._post(messages, session), None, time.perf_counter() - start
+            except Exception as e:
+                return None, e, time.perf_counter() - start
+
+        try:
+            for index, future in imap_bounded(run, messagesList, concurrency):
+                response, error, elapsed = future.result()
+                yield ChatResult(index=index, response=response, error=error, elapsed=elapsed)
+        finally:
+            if session is not self.session:
+                session.close()
+
+    def chat_stream(self, messages: list[dict[str, str]]):
+        """
+        以SSE流式方式请求，服务端每推送一个事件就yield一个数据块
+
+        Args:
+            messages: 对话消息列表
+
+        Yields:
+            chat.completion.chunk 格式的字典，增量内容在 choices[0].delta.content
+        """
+        url = f"{self.baseUrl}/chat/completions"
+        payload = self._build_payload(messages)
+        payload["stream"] = True
+
+        self.lastTtft = None
+        start = time.perf_counter()
+        try:
+            with self.session.post(url, json=payload, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                # iter_lines 按到达的数据逐行解析，不会把整个body读进内存
+                for line in response.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if self.lastTtft is None and self.get_delta_content(chunk):
+                        self.lastTtft = time.perf_counter() - start
+                    yield chunk
         except requests.exceptions.RequestException as e:
             raise Exception(f"LLM请求失败: {e}")
 
+    def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._asyncClient is not None and self._asyncLoop is not loop:
+            if not dispose_async_client(self._asyncClient, self._asyncLoop):
+                self._staleAsyncClients.append((self._asyncClient, self._asyncLoop))
+            self._asyncClient = None
+        if self._asyncClient is None:
+            # 所有协程共用一个有上限的连接池，超过poolSize的请求会排队等待连接
+            limits = httpx.Limits(max_connections=self.poolSize, max_keepalive_connections=self.poolSize)
+            self._asyncClient = httpx.AsyncClient(headers=self.headers, limits=limits,
+                                                  timeout=httpx.Timeout(self.timeout))
+            self._asyncLoop = loop
+        return self._asyncClient
+
+    async def achat(self, messages: list[dict[str, str]]):
+        url = f"{self.baseUrl}/chat/completions"
+        payload = self._build_payload(messages)
+        payload["stream"] = False
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.modelType, messages)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        try:
+            response = await self._get_async_client().post(url, json=payload)
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPError as e:
+            raise Exception(f"LLM请求失败: {e}")
+
+        if key is not None:
+            self.cache.set(key, result)
+        return result
+
+    async def aclose(self):
+        if self._asyncClient is not None:
+            if self._asyncLoop is asyncio.get_running_loop():
+                await self._asyncClient.aclose()
+            elif not dispose_async_client(self._asyncClient, self._asyncLoop):
+                self._staleAsyncClients.append((self._asyncClient, self._asyncLoop))
+            self._asyncClient = None
+            self._asyncLoop = None
+        self._close_stale_async_clients()
+
+    def close(self):
+        self.session.close()
+        if self._asyncClient is not None:
+            self._staleAsyncClients.append((self._asyncClient, self._asyncLoop))
+            self._asyncClient = None
+            self._asyncLoop = None
+        self._close_stale_async_clients()
+
+    def _close_stale_async_clients(self):
+        stale, self._staleAsyncClients = self._staleAsyncClients, []
+        for client, loop in stale:
+            if not dispose_async_client(client, loop):
+                # 所属的事件循环既没关闭也没运行，当前线程又有别的循环在运行，只能断开连接
+                shutdown_connections(client)
+
     def get_text_content(self, response) -> str:
             """
             从LLM响应中提取纯文字内容
@@ -62,8 +286,148 @@ class LLMClient:
             except Exception as e:
                 raise Exception(f"提取文字内容失败: {e}")
 
+    def get_delta_content(self, chunk) -> str:
+            """
+            从流式数据块中提取本次增量的文字内容
+
+            Args:
+                chunk: chat.completion.chunk 格式的数据块
+
+            Returns:
+                增量文字，没有内容时返回空字符串
+            """
+            choices = chunk.get('choices') or []
+            if not choices:
+                return ""
+            delta = choices[0].get('delta') or {}
+            return delta.get('content') or choices[0].get('text') or ""
+
+    def get_text_content_stream(self, chunks) -> str:
+            """
+            get_text_content 的流式版本，从数据块序列中拼接出完整的文字内容
+
+            Args:
+                chunks: chat_stream 返回的数据块迭代器
+
+            Returns:
+                拼接后的纯文字内容
+            """
+            try:
+                # 先收集到列表最后一次性join，避免循环里 += 字符串
+                parts = [self.get_delta_content(chunk) for chunk in chunks]
+                return "".join(parts).strip()
+            except Exception as e:
+                raise Exception(f"提取文字内容失败: {e}")
+
+def benchmark_test(total=200, latency=0.01):
+    """对比裸requests.post、连接池Session和异步achat在本地模拟服务上的吞吐和延迟"""
+    from mock_server import MockLLMServer
+    from bench import summarize
+
+    messages = [{'role': 'user', 'content': 'hello'}]
+    with MockLLMServer(latency=latency) as mock:
+        client = LLMClient(baseUrl=mock.baseUrl)
+        url = f"{client.baseUrl}/chat/completions"
+        payload = client._build_payload(messages)
+
+        # 1. 每次都新建连接
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(total):
+            t = time.perf_counter()
+            requests.post(url, headers=client.headers, json=payload).json()
+            latencies.append(time.perf_counter() - t)
+        summarize("requests.post", latencies, time.perf_counter() - start)
+
+        # 2. 连接池复用
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(total):
+            t = time.perf_counter()
+            client.chat(messages)
+            latencies.append(time.perf_counter() - t)
+        summarize("LLMClient.chat (pooled)", latencies, time.perf_counter() - start)
+
+        # 3. 异步并发，共享一个有上限的连接池
+        async def run_async():
+            async def one():
+                t = time.perf_counter()
+                await client.achat(messages)
+                return time.perf_counter() - t
+            begin = time.perf_counter()
+            result = await asyncio.gather(*(one() for _ in range(total)))
+            elapsed = time.perf_counter() - begin
+            await client.aclose()
+            return result, elapsed
+
+        latencies, elapsed = asyncio.run(run_async())
+        summarize(f"LLMClient.achat (pool={client.poolSize})", latencies, elapsed)
+        client.close()
+
+    # 4. 流式：对比首个token耗时和完整响应耗时
+    with MockLLMServer(latency=latency, tokenDelay=latency,
+                       reply="one two three four five six seven eight nine ten") as mock:
+        client = LLMClient(baseUrl=mock.baseUrl, stream=True)
+        ttfts, latencies = [], []
+        start = time.perf_counter()
+        for _ in range(total // 10):
+            t = time.perf_counter()
+            client.get_text_content_stream(client.chat_stream(messages))
+            latencies.append(time.perf_counter() - t)
+            ttfts.append(client.lastTtft)
+        elapsed = time.perf_counter() - start
+        summarize("LLMClient.chat_stream TTFT", ttfts, elapsed)
+        summarize("LLMClient.chat_stream total", latencies, elapsed)
+        client.close()
+
+def chat_many_benchmark_test(total=200, latency=0.05):
+    """在本地模拟服务上测量chat_many的吞吐随并发数的变化"""
+    from mock_server import MockLLMServer
+    from bench import summarize
+
+    messagesList = [[{'role': 'user', 'content': f'translate #{i}'}] for i in range(total)]
+    with MockLLMServer(latency=latency) as mock:
+        baseline = None
+        for concurrency in (1, 2, 4, 8, 16, 32):
+            client = LLMClient(baseUrl=mock.baseUrl, poolSize=concurrency)
+            latencies = []
+
+            start = time.perf_counter()
+            for result in client.chat_many(messagesList, max_concurrency=concurrency, as_completed=True):
+                if not result.ok:
+                    raise result.error
+                latencies.append(result.elapsed)
+            elapsed = time.perf_counter() - start
+            client.close()
+
+            stats = summarize(f"chat_many concurrency={concurrency}", latencies, elapsed)
+            baseline = baseline or stats["rps"]
+            print(f"{'':<28} speedup x{stats['rps'] / baseline:.2f}")
+
+def stream_test():
+    client = LLMClient(stream=True)
+    messages = [
+        {'role': 'user', 'content': '给我讲一个关于熊的笑话'}
+    ]
+
+    def print_deltas(chunks):
+        # 边接收边输出，同时把数据块交给get_text_content_stream拼接
+        for chunk in chunks:
+            print(client.get_delta_content(chunk), end="", flush=True)
+            yield chunk
+
+    text_content = client.get_text_content_stream(print_deltas(client.chat_stream(messages)))
+    print(f"\n首个token耗时: {client.lastTtft:.3f}s")
+    print(f"提取的文字内容: {text_content}")
+
 if __name__ == '__main__':
-    client = LLMClient()
+    # stream_test()
+    # chat_many_benchmark_test()
+    # benchmark_test()
+    from llm_cache import default_response_cache
+
+    cache = default_response_cache()
+    client = LLMClient(cache=cache)
     # 发送聊天请求
     customer_email = """
     Arrr, I be fuming that me blender lid \
@@ -91,6 +455,8 @@ if __name__ == '__main__':
         print(f"完整响应: {response}")
         text_content = client.get_text_content(response)
         print(f"提取的文字内容: {text_content}")
+        # 第二次运行时直接命中缓存
+        print(f"缓存统计: {cache.stats()}")
 
     except Exception as e:
         print(f"错误: {e}")
@@ -1,12 +1,13 @@
-from openai import OpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from config import config
+from model_registry import get_openai_client
 
 class LLMClient:
     def __init__(self):
         self.baseUrl = config["baseUrl"]
         self.apiKey = config["apiKey"]
-        self.client = OpenAI(api_key=self.apiKey, base_url=self.baseUrl)
+        # 同一个 baseUrl 共享 OpenAI 客户端和连接池
+        self.client = get_openai_client(self.baseUrl, self.apiKey)
 
     def chat(self, messages, model=None, stream=False):
         model = model or config["model"]
@@ -1,8 +1,9 @@
-from openai import OpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from config import config
+from model_registry import get_openai_client
+from streaming_parser import StreamingPydanticParser
 
 class Gift(BaseModel):
     gift: str = Field(description="Was the item purchased\
@@ -25,7 +26,8 @@ class LLMClient:
     def __init__(self):
         self.baseUrl = config["baseUrl"]
         self.apiKey = config["apiKey"]
-        self.client = OpenAI(api_key=self.apiKey, base_url=self.baseUrl)
+        # 同一个 baseUrl 共享 OpenAI 客户端和连接池
+        self.client = get_openai_client(self.baseUrl, self.apiKey)
 
     def chat(self, messages, model=None, stream=False):
         model = model or config["model"]
@@ -99,5 +101,48 @@ def testParser():
         import traceback
         traceback.print_exc()
 
+def testStreamingParser():
+    """流式请求，每个字段一生成完就解析出来，不用等整个回复结束"""
+    import time
+
+    client = LLMClient()
+    customer_review = """\
+        It arrived in two days, just in time for my wife's anniversary present. \
+        It's slightly more expensive than the other leaf blowers \
+        out there, but I think it's worth it for the extra features.
+        """
+    review_template = """\
+        For the following text, extract the following information:
+
+        gift: Was the item purchased as a gift for someone else? \
+        Answer True if yes, False if not or unknown.
+
+        delivery_days: How many days did it take for the product\
+        to arrive? If this information is not found, output -1.
+
+        price_value: Extract any sentences about the value or price,\
+        and output them as a comma separated Python list.
+
+        text: {text}
+
+        {format_instructions}
+        """
+    parser = PydanticOutputParser(pydantic_object=Gift)
+    reviewPrompt = ChatPromptTemplate.from_template(review_template).format_messages(
+        text=customer_review, format_instructions=parser.get_format_instructions())
+    messages = [{'role': 'user', 'content': f"{reviewPrompt}"}]
+
+    streamingParser = StreamingPydanticParser(Gift)
+    start = time.perf_counter()
+    for chunk in client.chat(messages, stream=True):
+        if not chunk.choices:
+            continue
+        for name, value in streamingParser.feed(chunk.choices[0].delta.content or ""):
+            # 这里就可以开始处理已经完成的字段
+            print(f"{(time.perf_counter() - start) * 1000:8.1f} ms  {name} = {value!r}")
+    gift = streamingParser.finish()
+    print(f"{(time.perf_counter() - start) * 1000:8.1f} ms  完成: {gift}")
+
 if __name__ == '__main__':
-    testParser()
\ No newline at end of file
+    testParser()
+    # testStreamingParser()
\ No newline at end of file
@@ -1,18 +1,17 @@
-from typing import Dict
-from langchain_openai import ChatOpenAI
-from config import config
+import os
+import random
+import tempfile
+import time
+from model_registry import get_chat_model
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage
+from sqlite_history import SQLiteHistoryStore
+from history_window import HistoryWindow, llm_summarizer
 
 def conversation_buffer_memory_test():
     # 1. 初始化llm
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    llm = get_chat_model(temperature=0)
 
     # 2. 构建提示词模板
     prompt = ChatPromptTemplate.from_messages([("system","你是一个友好的助手"),
@@ -23,17 +22,14 @@ def conversation_buffer_memory_test():
     # 3. 构建基础链
     base_chain = prompt | llm
 
-    # 4. 为不同会话提供独立的历史存储（这里使用内存字典，生产环境需替换为数据库）
-    store: Dict[str, ChatMessageHistory] = {}
-    def get_session_history(session_id: str) -> ChatMessageHistory:
-        if session_id not in store:
-            store[session_id] = ChatMessageHistory()
-        return store[session_id]
+    # 4. 为不同会话提供独立的历史存储（SQLite 持久化，内存中只保留最近活跃的会话）
+    # 演示用临时数据库，每次运行都从空历史开始；实际使用时传入固定的文件路径
+    store = SQLiteHistoryStore(path=os.path.join(tempfile.mkdtemp(), "chat_history.db"))
 
     # 5. 用 RunnableWithMessageHistory 包装基础链
     chain_with_history = RunnableWithMessageHistory(
         base_chain,
-        get_session_history,  # 提供历史获取函数
+        store.get_session_history,  # 提供历史获取函数
         input_messages_key="input",  # 用户输入对应的键
         history_messages_key="chat_history",  # 提示词中历史占位符的变量名
     )
@@ -57,6 +53,64 @@ def conversation_buffer_memory_test():
         config={"configurable": {"session_id": "user_123"}}
     )
     print(response3.content)
+    store.close()
+
+def token_window_memory_test():
+    llm = get_chat_model(temperature=0)
+    prompt = ChatPromptTemplate.from_messages([("system","你是一个友好的助手"),
+                                      MessagesPlaceholder(variable_name="chat_history"),
+                                      ("human", "{input}")
+                                      ])
+    base_chain = prompt | llm
+
+    # 历史只注入最近 200 个 token 以内的消息，更早的对话折叠成摘要
+    store = SQLiteHistoryStore(path=os.path.join(tempfile.mkdtemp(), "chat_history.db"))
+    window = HistoryWindow(maxTokens=200, summarizer=llm_summarizer(llm), summaryReserve=80)
+    chain_with_history = RunnableWithMessageHistory(
+        base_chain,
+        window.wrap(store.get_session_history),
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
+
+    for text in ["你好，我叫张三", "给我讲一个关于程序员的笑话", "再讲一个关于熊的笑话", "我刚才说我叫什么名字？"]:
+        response = chain_with_history.invoke(
+            {"input": text},
+            config={"configurable": {"session_id": "user_456"}}
+        )
+        print(response.content)
+    store.close()
+
+def sqlite_history_benchmark_test(sessions=100_000, loads=2_000):
+    """压测 SQLiteHistoryStore 的追加和加载延迟，并观察会话数增长时的内存峰值"""
+    from bench import summarize, peak_rss_mb
+
+    path = os.path.join(tempfile.mkdtemp(), "bench_history.db")
+    store = SQLiteHistoryStore(path=path)
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(sessions):
+        history = store.get_session_history(f"user_{i}")
+        t = time.perf_counter()
+        history.add_messages([HumanMessage(content=f"你好，我是第{i}个用户"), AIMessage(content="你好！")])
+        latencies.append(time.perf_counter() - t)
+        if (i + 1) % (sessions // 5) == 0:
+            print(f"{i + 1} sessions, hot={store.hotSessions}, peak RSS {peak_rss_mb():.1f} MB")
+    store.flush()
+    summarize("append (2 messages)", latencies, time.perf_counter() - start)
+
+    # 随机加载不在内存中的会话
+    latencies = []
+    start = time.perf_counter()
+    for session_id in random.sample(range(sessions), loads):
+        t = time.perf_counter()
+        store.get_session_history(f"user_{session_id}").messages
+        latencies.append(time.perf_counter() - t)
+    summarize("load (cold)", latencies, time.perf_counter() - start)
+    store.close()
 
 if __name__ == '__main__':
+    # sqlite_history_benchmark_test()
+    # token_window_memory_test()
     conversation_buffer_memory_test()
\ No newline at end of file
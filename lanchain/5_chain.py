@@ -1,17 +1,14 @@
-from langchain_openai import ChatOpenAI
-from config import config
+from model_registry import get_chat_model, pool_stats
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.runnables import RunnableBranch
+from langchain_core.runnables import RunnableLambda
+from ttl_cache import TTLCache
+from keyword_router import KeywordRouter
 
 def chain_test():
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    llm = get_chat_model(temperature=0)
     prompt = ChatPromptTemplate.from_template(
         "What is the best name to describe \
         a company that makes {product}?"
@@ -28,12 +25,7 @@ def chain_test():
 
 # 单输入输出
 def single_seq_chain_test():
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    llm = get_chat_model(temperature=0)
     # 第一链：生成笑话
     prompt1 = ChatPromptTemplate.from_template("讲一个关于{主题}的笑话")
     chain1 = prompt1 | llm | StrOutputParser()
@@ -50,12 +42,7 @@ def single_seq_chain_test():
 
 # 多输入输出
 def seq_chain_test():
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    llm = get_chat_model(temperature=0)
 
     # 第一步：生成描述 (并保留所有初始输入)
     description_prompt = ChatPromptTemplate.from_template(
@@ -77,25 +64,24 @@ def seq_chain_test():
     print(result)
     print(type(result))
 
+PHYSICS_KEYWORDS = ["力", "运动", "能量", "量子", "物理"]
+MATH_KEYWORDS = ["方程", "积分", "几何", "代数", "数学", "计算"]
+
 def route_to_physics(input_dict):
     """判断是否路由到物理链"""
     query = input_dict.get("query", "").lower()
-    physics_keywords = ["力", "运动", "能量", "量子", "物理"]
-    return any(keyword in query for keyword in physics_keywords)
+    return any(keyword in query for keyword in PHYSICS_KEYWORDS)
 
 def route_to_math(input_dict):
     """判断是否路由到数学链"""
     query = input_dict.get("query", "").lower()
-    math_keywords = ["方程", "积分", "几何", "代数", "数学", "计算"]
-    return any(keyword in query for keyword in math_keywords)
+    return any(keyword in query for keyword in MATH_KEYWORDS)
+
+# 所有分支的关键词编译进一个自动机，问题只扫描一遍；按分支顺序优先，与 RunnableBranch 的结果一致
+keyword_router = KeywordRouter({"physics": PHYSICS_KEYWORDS, "math": MATH_KEYWORDS}, strategy="priority")
 
 def route_chain_test():
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    llm = get_chat_model(temperature=0)
     parser = StrOutputParser()
 
     # 1. 物理链
@@ -119,23 +105,51 @@ def route_chain_test():
     ])
     default_chain = default_prompt | llm | parser
 
-    branch = RunnableBranch(
-        (route_to_physics, physics_chain),
-        (route_to_math, math_chain),
-        default_chain
-    )
+    branch = keyword_router.as_runnable({"physics": physics_chain, "math": math_chain}, default_chain)
 
     # 现在 `branch` 就是一个可以调用的路由链
     result = branch.invoke({"query": "请解释一下牛顿第二定律。"})
     print(f"路由结果（物理）: {result}")
 
-def llm_route_chain_test():
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+def keyword_router_benchmark_test(branches=20, keywords_per_branch=500, query_len=5000, queries=20):
+    """对比逐分支 any(keyword in query) 扫描和 Aho-Corasick 单次扫描的耗时"""
+    import random
+    import time
+
+    rng = random.Random(0)
+    alphabet = [chr(c) for c in range(0x4e00, 0x4e00 + 2000)]
+    routes = {f"branch_{b}": ["".join(rng.choices(alphabet, k=rng.randint(2, 4)))
+                              for _ in range(keywords_per_branch)]
+              for b in range(branches)}
+    inputs = [{"query": "".join(rng.choices(alphabet, k=query_len))} for _ in range(queries)]
+
+    def naive_classify(input_dict):
+        query = input_dict.get("query", "").lower()
+        for label, keywords in routes.items():
+            if any(keyword in query for keyword in keywords):
+                return label
+        return None
+
+    start = time.perf_counter()
+    router = KeywordRouter(routes, strategy="priority")
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    router_labels = [router.classify(item["query"]) for item in inputs]
+    router_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    naive_labels = [naive_classify(item) for item in inputs]
+    naive_time = time.perf_counter() - start
+
+    print(f"{branches} 个分支 x {keywords_per_branch} 个关键词，问题长度 {query_len}，共 {queries} 个问题")
+    print(f"自动机构建: {build_time * 1000:.1f} ms")
+    print(f"逐分支扫描: {naive_time / queries * 1000:.2f} ms/问题")
+    print(f"单次扫描:   {router_time / queries * 1000:.2f} ms/问题")
+    print(f"路由结果一致: {router_labels == naive_labels}")
+
+def build_llm_route_chains(llm):
+    """构建分类链和三个领域链"""
     parser = StrOutputParser()
 
     # 1. 创建一个LLM来辅助分类
@@ -147,12 +161,6 @@ def llm_route_chain_test():
     分类：""")
     classifier_chain = classifier_prompt | llm | StrOutputParser()
 
-    def llm_base_router(classification):
-        def router(query):
-            actual_class = classifier_chain.invoke(query)
-            return  actual_class.strip() == classification
-        return router
-
     # 1. 物理链
     physics_prompt = ChatPromptTemplate.from_messages([
         ("system", "你是一位物理学家，用严谨的物理学术语回答问题。"),
@@ -174,20 +182,97 @@ def llm_route_chain_test():
     ])
     default_chain = default_prompt | llm | parser
 
-    branch = RunnableBranch(
-        (llm_base_router("physics"), physics_chain),
-        (llm_base_router("math"), math_chain),
-        default_chain
-    )
+    return classifier_chain, {"physics": physics_chain, "math": math_chain}, default_chain
 
-    # 现在 `branch` 就是一个可以调用的路由链
-    result = branch.invoke({"query": "请解释一下牛顿第二定律。"})
+def llm_classify_router(classifier_chain, routes, default_chain, maxsize=1024, ttl=3600):
+    """
+    每个输入只调用一次分类链，然后直接分发到对应的链
+
+    RunnableBranch 会为每个分支各调用一次分类，"general" 的问题要分类两次才能落到默认链；
+    这里分类结果按问题缓存，相同的问题再次路由时不调用分类链。
+    """
+    labels = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def route(input_dict):
+        query = input_dict["query"]
+        label = labels.get(query)
+        if label is None:
+            label = classifier_chain.invoke(input_dict).strip().strip("'\"").lower()
+            labels.set(query, label)
+        # 返回的链会被 RunnableLambda 用同一个输入继续调用
+        return routes.get(label, default_chain)
+
+    router = RunnableLambda(route)
+    router.labels = labels
+    return router
+
+def llm_route_chain_test():
+    llm = get_chat_model(temperature=0)
+    classifier_chain, routes, default_chain = build_llm_route_chains(llm)
+    router = llm_classify_router(classifier_chain, routes, default_chain)
+
+    # 现在 `router` 就是一个可以调用的路由链
+    result = router.invoke({"query": "请解释一下牛顿第二定律。"})
     print(f"结果: {result}")
 
+def llm_route_benchmark_test(queries=20, distinct=5):
+    """在本地模拟服务上对比 RunnableBranch 和单次分类路由每个问题的 LLM 调用次数"""
+    from mock_server import MockLLMServer
+
+    inputs = [{"query": f"问题{i % distinct}"} for i in range(queries)]
+    # 模拟服务总是返回 general，这是 RunnableBranch 最差的情况
+    with MockLLMServer(reply="general") as mock:
+        # 不使用响应缓存，统计真实调用次数
+        llm = get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False)
+        classifier_chain, routes, default_chain = build_llm_route_chains(llm)
+
+        def llm_base_router(classification):
+            def router(query):
+                actual_class = classifier_chain.invoke(query)
+                return  actual_class.strip() == classification
+            return router
+
+        branch = RunnableBranch(
+            (llm_base_router("physics"), routes["physics"]),
+            (llm_base_router("math"), routes["math"]),
+            default_chain
+        )
+        for item in inputs:
+            branch.invoke(item)
+        branch_calls = mock.requestCount
+
+        router = llm_classify_router(classifier_chain, routes, default_chain)
+        for item in inputs:
+            router.invoke(item)
+        router_calls = mock.requestCount - branch_calls
+
+    print(f"RunnableBranch: 每个问题 {branch_calls / queries:.2f} 次LLM调用")
+    print(f"单次分类路由:   每个问题 {router_calls / queries:.2f} 次LLM调用（{distinct} 个不同问题）")
+
+def shared_model_test(rounds=20):
+    """多次调用链路，确认拿到的是同一个模型实例，连接池里的连接被复用"""
+    from mock_server import MockLLMServer
+
+    with MockLLMServer() as mock:
+        models = set()
+        for _ in range(rounds):
+            llm = get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False)
+            models.add(id(llm))
+            (ChatPromptTemplate.from_template("讲一个关于{topic}的笑话") | llm | StrOutputParser()).invoke({"topic": "熊"})
+        print(f"{rounds} 次调用共创建 {len(models)} 个模型实例")
+        print(f"连接池统计: {pool_stats()['endpoints'][mock.baseUrl]}")
 
 if __name__ == '__main__':
+    from llm_cache import enable_langchain_cache
+
+    # temperature=0 时相同的请求结果一致，开启缓存后重复运行不再请求服务端
+    cache = enable_langchain_cache()
     # chain_test()
     # single_seq_chain_test()
     #seq_chain_test()
     #route_chain_test()
-    llm_route_chain_test()
\ No newline at end of file
+    # keyword_router_benchmark_test()
+    # llm_route_benchmark_test()
+    # shared_model_test()
+    llm_route_chain_test()
+    print(f"缓存统计: {cache.stats()}")
\ No newline at end of file
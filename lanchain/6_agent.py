@@ -1,16 +1,10 @@
 from langchain_core.tools import tool
-from config import config
 from langchain.agents import create_agent
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 
 def agent_test():
     # 初始化llm
-    llm = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    llm = get_chat_model(temperature=0)
 
     # 解析工具
     @tool
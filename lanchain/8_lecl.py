@@ -1,21 +1,85 @@
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 from config import config
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from instrumentation import InstrumentationHandler, instrumented_http_clients
 
 def simple_lecl_test():
+    llm = get_chat_model(temperature=0)
+    prompt = ChatPromptTemplate.from_template("给我讲一个关于{topic}的笑话")
+    parser = StrOutputParser()
+    chain = prompt | llm | parser
+    response = chain.invoke({"topic":"熊"})
+    print(response)
+    print(type(response))
+
+def instrumented_lecl_test():
+    # 统计每个阶段的耗时、token 数，以及模型阶段的排队和网络耗时
+    from langchain_openai import ChatOpenAI
+
+    handler = InstrumentationHandler()
+    http_client, http_async_client = instrumented_http_clients(handler)
     llm = ChatOpenAI(
         model=config["model"],
         temperature=0,
         base_url=config["baseUrl"],  # 你的baseUrl
         api_key=config["apiKey"],  # 你的apiKey
+        http_client=http_client,
+        http_async_client=http_async_client,
     )
     prompt = ChatPromptTemplate.from_template("给我讲一个关于{topic}的笑话")
-    parser = StrOutputParser()
-    chain = prompt | llm | parser
-    response = chain.invoke({"topic":"熊"})
+    chain = prompt | llm | StrOutputParser()
+
+    response = chain.invoke({"topic": "熊"}, config={"callbacks": [handler]})
     print(response)
-    print(type(response))
+    # 流式调用时可以统计首个 token 的耗时
+    for _ in chain.stream({"topic": "程序员"}, config={"callbacks": [handler]}):
+        pass
+
+    print(handler.to_json_lines())
+    print(handler.prometheus_text())
+
+def instrumentation_overhead_test(iterations=200, latency=0.02):
+    """在本地模拟服务上对比开启和关闭统计时每次调用的平均耗时"""
+    import time
+    from langchain_openai import ChatOpenAI
+    from mock_server import MockLLMServer
+
+    with MockLLMServer(latency=latency) as mock:
+        handler = InstrumentationHandler()
+        http_client, http_async_client = instrumented_http_clients(handler)
+        llm = ChatOpenAI(
+            model=config["model"],
+            temperature=0,
+            base_url=mock.baseUrl,
+            api_key=config["apiKey"],
+            http_client=http_client,
+            http_async_client=http_async_client,
+            cache=False,
+        )
+        chain = ChatPromptTemplate.from_template("给我讲一个关于{topic}的笑话") | llm | StrOutputParser()
+
+        def measure(run_config):
+            chain.invoke({"topic": "熊"}, config=run_config)  # 预热
+            # 墙钟时间受模拟服务延迟波动影响较大，额外开销用本线程的 CPU 时间衡量
+            cpu_start = time.thread_time()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                chain.invoke({"topic": "熊"}, config=run_config)
+            return (time.perf_counter() - start) / iterations, (time.thread_time() - cpu_start) / iterations
+
+        wall, cpu = measure({})
+        instrumented_wall, instrumented_cpu = measure({"callbacks": [handler]})
+    print(f"关闭统计: {wall * 1000:.2f} ms/次, CPU {cpu * 1000:.3f} ms/次")
+    print(f"开启统计: {instrumented_wall * 1000:.2f} ms/次, CPU {instrumented_cpu * 1000:.3f} ms/次")
+    print(f"额外开销: {(instrumented_cpu - cpu) / wall:.2%}（额外 CPU 时间 / 每次调用耗时）")
 
 if __name__ == '__main__':
-    simple_lecl_test()
\ No newline at end of file
+    from llm_cache import enable_langchain_cache
+
+    # instrumented_lecl_test()
+    # instrumentation_overhead_test()
+    # temperature=0 时相同的请求结果一致，开启缓存后重复运行不再请求服务端
+    cache = enable_langchain_cache()
+    simple_lecl_test()
+    print(f"缓存统计: {cache.stats()}")
\ No newline at end of file
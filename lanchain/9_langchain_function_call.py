@@ -1,11 +1,9 @@
-from config import config
-
 from pydantic import BaseModel, Field
 import json
 
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.utils.function_calling import convert_to_openai_tool
+from tool_schema import openai_tool, bind_tools_cached
 
 class WeatherSearch(BaseModel):
     """Get the current weather in a given location"""
@@ -23,12 +21,7 @@ def get_current_weather(location, unit="摄氏度"):
 
 def langchain_function_call_test():
     # 1. 创建llm
-    model = ChatOpenAI(
-        model=config["model"],
-        temperature=0,
-        base_url=config["baseUrl"],  # 你的baseUrl
-        api_key=config["apiKey"],  # 你的apiKey
-    )
+    model = get_chat_model(temperature=0)
 
     # 2. 构建提示词模板
     prompt = ChatPromptTemplate.from_messages([("system", "你是一个友好的助手"),
@@ -36,10 +29,10 @@ def langchain_function_call_test():
                                                ])
     #print(f"prompt: {prompt}")
 
-    # 3. 绑定函数
-    weather_function = convert_to_openai_tool(WeatherSearch)
+    # 3. 绑定函数，schema 和绑定后的模型在进程内只生成一次
+    weather_function = openai_tool(WeatherSearch)
     #print(f"weather_function: {weather_function}")
-    model_with_function = model.bind(tools=[weather_function])
+    model_with_function = bind_tools_cached(model, [weather_function])
 
     chain = prompt | model_with_function
 
@@ -82,8 +75,42 @@ def langchain_function_call_test():
                 final_response = model_with_function.invoke(messages)
                 print(f"\nAI回答: {final_response.content}")
 
+def tool_binding_benchmark_test(iterations=300):
+    """在本地模拟服务上对比每次请求都重新生成 schema 并绑定，和使用缓存时客户端的 CPU 开销"""
+    import time
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+    from mock_server import MockLLMServer
+
+    with MockLLMServer() as mock:
+        model = get_chat_model(baseUrl=mock.baseUrl, temperature=0, cache=False)
+        prompt = ChatPromptTemplate.from_messages([("system", "你是一个友好的助手"), ("human", "{input}")])
+
+        def uncached():
+            return prompt | model.bind(tools=[convert_to_openai_tool(WeatherSearch)])
+
+        def cached():
+            return prompt | bind_tools_cached(model, [openai_tool(WeatherSearch)])
+
+        variants = {"每次重新绑定": uncached, "缓存 schema 和绑定": cached}
+        bind_cpu = dict.fromkeys(variants, 0.0)
+        total_cpu = dict.fromkeys(variants, 0.0)
+        for build in variants.values():
+            build().invoke({"input": "大连天气怎么样?"})  # 预热
+        # 两种方式交替执行，避免先后顺序带来的偏差
+        for _ in range(iterations):
+            for name, build in variants.items():
+                start = time.thread_time()
+                chain = build()
+                bind_cpu[name] += time.thread_time() - start
+                chain.invoke({"input": "大连天气怎么样?"})
+                total_cpu[name] += time.thread_time() - start
+        for name in variants:
+            print(f"{name}: 绑定 {bind_cpu[name] / iterations * 1e6:8.1f} us/次，"
+                  f"整个请求客户端 CPU {total_cpu[name] / iterations * 1000:6.3f} ms/次")
+
 if __name__ == "__main__":
     langchain_function_call_test()
+    # tool_binding_benchmark_test()
 
 
     
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+课程统一入口：按名称运行 lanchain 目录下某个课程的函数。
+只加载选中的课程模块，课程里较重的依赖（langchain_openai、文档加载器、wikipedia……）
+都在函数里或第一次创建模型时才导入，短任务不再为用不到的依赖付启动时间
+
+用法:
+    python launcher.py 5_chain chain_test
+    python launcher.py 10_tagging_extraction web_extraction_test max_in_flight=8 target_tokens=4000
+    python launcher.py 12_complete_agent chat_agent --cache
+    python launcher.py 10_tagging_extraction --list
+    python launcher.py 12_complete_agent --importtime            # 类似 -X importtime 的导入耗时树
+    python launcher.py --startup-bench --repeat 5                 # 启动耗时回归测试
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+LESSON_DIR = os.path.join(ROOT_DIR, "lanchain")
+for path in (ROOT_DIR, LESSON_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+_lessons = {}
+
+
+def lesson_names() -> list[str]:
+    names = [name[:-3] for name in os.listdir(LESSON_DIR) if name.endswith(".py") and name[0].isdigit()]
+    return sorted(names, key=lambda name: int(name.split("_", 1)[0]))
+
+
+def load_lesson(name: str):
+    """按文件名加载 lanchain 目录下的课程模块，例如 load_lesson("8_lecl")"""
+    if name not in _lessons:
+        import importlib.util
+
+        path = os.path.join(LESSON_DIR, f"{name}.py")
+        if not os.path.exists(path):
+            raise ValueError(f"unknown lesson: {name}")
+        spec = importlib.util.spec_from_file_location(f"lesson_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _lessons[name] = module
+    return _lessons[name]
+
+
+def lesson_functions(module) -> list[str]:
+    """课程模块里定义的公开函数"""
+    return [name for name, value in vars(module).items()
+            if callable(value) and getattr(value, "__module__", None) == module.__name__
+            and not name.startswith("_") and not isinstance(value, type)]
+
+
+def parse_call_args(items: list[str]) -> tuple[list, dict]:
+    """命令行参数转成函数参数：key=value 是关键字参数，值按 Python 字面量解析，解析失败时当作字符串"""
+    def parse(value: str):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+    args, kwargs = [], {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if sep and key.isidentifier():
+            kwargs[key] = parse(value)
+        else:
+            args.append(parse(item))
+    return args, kwargs
+
+
+def run(lesson: str, function: str, items: list[str], cache=False):
+    module = load_lesson(lesson)
+    func = getattr(module, function, None)
+    if not callable(func):
+        raise ValueError(f"{lesson} has no function {function}, available: {', '.join(lesson_functions(module))}")
+    if cache:
+        from llm_cache import enable_langchain_cache
+        enable_langchain_cache()
+    args, kwargs = parse_call_args(items)
+    return func(*args, **kwargs)
+
+
+# ---------- 导入耗时 ----------
+
+def _import_only_command(lesson: str) -> list[str]:
+    return [sys.executable, os.path.abspath(__file__), lesson, "--import-only"]
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """
+    解析 -X importtime 的输出，返回导入树的根节点列表。
+    输出是后序的（子模块先于父模块打印），缩进每深一层多两个空格
+    """
+    pending: dict[int, list[dict]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        node = {
+            "name": name.strip(),
+            "self_us": int(parts[0]),
+            "cumulative_us": int(parts[1]),
+            "children": pending.pop(level + 1, []),
+        }
+        pending.setdefault(level, []).append(node)
+    return pending.get(0, [])
+
+
+def format_import_tree(roots: list[dict], minMs=5.0) -> str:
+    """按累计耗时从大到小打印导入树，累计耗时小于 minMs 的子树省略"""
+    lines = [f"{'cumulative':>12} {'self':>10}  module"]
+
+    def walk(nodes, depth):
+        for node in sorted(nodes, key=lambda node: node["cumulative_us"], reverse=True):
+            if node["cumulative_us"] < minMs * 1000:
+                continue
+            lines.append(f"{node['cumulative_us'] / 1000:>9.1f} ms {node['self_us'] / 1000:>7.1f} ms  "
+                         f"{'  ' * depth}{node['name']}")
+            walk(node["children"], depth + 1)
+
+    walk(roots, 0)
+    total = sum(node["cumulative_us"] for node in roots) / 1000
+    lines.append(f"导入总耗时 {total:.1f} ms")
+    return "\n".join(lines)
+
+
+def import_profile(lesson: str, minMs=5.0) -> str:
+    """在子进程里用 -X importtime 只导入课程模块，返回导入耗时树"""
+    command = [sys.executable, "-X", "importtime"] + _import_only_command(lesson)[1:]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=ROOT_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {lesson} failed:\n{result.stderr[-2000:]}")
+    return format_import_tree(parse_importtime(result.stderr), minMs)
+
+
+# ---------- 启动耗时回归测试 ----------
+
+def startup_time(command: list[str], repeat=5) -> float:
+    """子进程从启动到退出的耗时中位数（秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True, cwd=ROOT_DIR)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def startup_benchmark(lessons=None, repeat=5, baselinePath="startup_baseline.json",
+                      tolerance=0.25, updateBaseline=False) -> int:
+    """
+    统计每个课程的冷启动耗时并和基线比较，超过基线 (1 + tolerance) 倍时视为回归，返回非零退出码。
+    基线和机器有关，第一次运行或传 updateBaseline=True 时写入
+    """
+    lessons = lessons or lesson_names()
+    interpreter = startup_time([sys.executable, "-c", "pass"], repeat)
+    print(f"{'python -c pass':<28} {interpreter * 1000:>8.1f} ms")
+
+    baseline = {}
+    if os.path.exists(baselinePath) and not updateBaseline:
+        with open(baselinePath, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results, regressions = {}, []
+    for lesson in lessons:
+        elapsed = startup_time(_import_only_command(lesson), repeat)
+        results[lesson] = elapsed
+        line = f"{lesson:<28} {elapsed * 1000:>8.1f} ms"
+        if lesson in baseline:
+            ratio = elapsed / baseline[lesson]
+            line += f"  基线 {baseline[lesson] * 1000:>8.1f} ms  {ratio:>5.2f}x"
+            if ratio > 1 + tolerance:
+                regressions.append(lesson)
+                line += "  回归"
+        print(line)
+
+    if not baseline:
+        with open(baselinePath, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"基线已写入 {baselinePath}")
+    if regressions:
+        print(f"启动耗时回归: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="运行 lanchain 课程中的函数")
+    arg_parser.add_argument("lesson", nargs="?", help="课程文件名，例如 5_chain")
+    arg_parser.add_argument("function", nargs="?", help="要运行的函数名")
+    arg_parser.add_argument("args", nargs="*", help="函数参数，key=value 为关键字参数")
+    arg_parser.add_argument("--list", action="store_true", help="列出课程和函数")
+    arg_parser.add_argument("--cache", action="store_true", help="开启 LangChain 响应缓存")
+    arg_parser.add_argument("--import-only", action="store_true", help="只导入课程模块，用于统计启动耗时")
+    arg_parser.add_argument("--importtime", action="store_true", help="打印导入课程模块的耗时树")
+    arg_parser.add_argument("--min-ms", type=float, default=5.0, help="导入耗时树中省略累计耗时更小的模块")
+    arg_parser.add_argument("--startup-bench", action="store_true", help="冷启动耗时回归测试")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--baseline", default="startup_baseline.json")
+    arg_parser.add_argument("--tolerance", type=float, default=0.25)
+    arg_parser.add_argument("--update-baseline", action="store_true")
+    args = arg_parser.parse_args(argv)
+
+    if args.startup_bench:
+        lessons = [args.lesson] if args.lesson else None
+        return startup_benchmark(lessons, args.repeat, args.baseline, args.tolerance, args.update_baseline)
+    if not args.lesson:
+        print("\n".join(lesson_names()))
+        return 0
+    if args.importtime:
+        print(import_profile(args.lesson, args.min_ms))
+        return 0
+    module = load_lesson(args.lesson)
+    if args.import_only:
+        return 0
+    if args.list or not args.function:
+        print("\n".join(lesson_functions(module)))
+        return 0
+    run(args.lesson, args.function, args.args, args.cache)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
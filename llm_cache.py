@@ -0,0 +1,268 @@
+"""
+temperature=0 的请求结果是确定的，按请求内容的哈希缓存响应：
+内存 LRU 作为第一级，磁盘目录作为第二级（按总大小淘汰最久未使用的文件）
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+
+from config import config
+
+
+class ResponseCache:
+    def __init__(self, maxItems=1024, cacheDir=None, maxDiskBytes=None):
+        self.maxItems = maxItems
+        self.cacheDir = cacheDir
+        self.maxDiskBytes = maxDiskBytes or config["cacheMaxBytes"]
+        self._memory: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictLock = threading.Lock()
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+        self._diskBytes = 0
+        if self.cacheDir:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self._diskBytes = sum(entry.stat().st_size for entry in os.scandir(self.cacheDir)
+                                  if entry.name.endswith(".json"))
+
+    @staticmethod
+    def make_key(model, messages, tools=None, tool_choice=None) -> str:
+        """按模型、消息、工具定义和tool_choice生成内容哈希"""
+        raw = json.dumps({"model": model, "messages": messages, "tools": tools, "tool_choice": tool_choice},
+                         sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def hits(self) -> int:
+        return self.memoryHits + self.diskHits
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memoryHits,
+            "disk_hits": self.diskHits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._diskBytes,
+        }
+
+    def get(self, key: str) -> Optional[Any]:
+        """返回缓存值的副本，调用方修改返回值不会影响缓存"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memoryHits += 1
+                return copy.deepcopy(self._memory[key])
+
+        # 磁盘读写不占用锁，慢的磁盘操作不会阻塞其他线程的内存命中
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.diskHits += 1
+            self._put_memory(key, value)
+            return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any):
+        """value 需要能被 json 序列化，缓存里保存的是副本"""
+        with self._lock:
+            self._put_memory(key, copy.deepcopy(value))
+        self._write_disk(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.cacheDir:
+                for entry in os.scandir(self.cacheDir):
+                    if entry.name.endswith(".json"):
+                        os.remove(entry.path)
+            self._diskBytes = 0
+
+    def _put_memory(self, key: str, value: Any):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxItems:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cacheDir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Any]:
+        if not self.cacheDir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # 用修改时间记录最近访问，淘汰时按它排序
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # 读的同时文件可能刚好被淘汰
+            return None
+        return value
+
+    def _write_disk(self, key: str, value: Any):
+        if not self.cacheDir:
+            return
+        path = self._path(key)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        # 先写临时文件再替换，避免并发读到写了一半的内容
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._diskBytes += os.path.getsize(path) - old_size
+            evict = self._diskBytes > self.maxDiskBytes
+        if evict:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # 同一时间只需要一个线程扫描目录，其他线程直接返回
+        if not self._evictLock.acquire(blocking=False):
+            return
+        try:
+            entries = sorted((entry for entry in os.scandir(self.cacheDir) if entry.name.endswith(".json")),
+                             key=lambda entry: entry.stat().st_mtime)
+            # 淘汰到上限的 90%，避免每次写入都触发一次目录扫描
+            target = self.maxDiskBytes * 0.9
+            for entry in entries:
+                if self._diskBytes <= target:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    self._diskBytes -= size
+        finally:
+            self._evictLock.release()
+
+
+# llm_string 里调用参数部分的 ('temperature', 0.7)
+_CALL_TEMPERATURE = re.compile(r"\('temperature', ([^)]*)\)")
+
+
+class LangChainResponseCache(BaseCache):
+    """把 ResponseCache 接入 LangChain 的 ChatOpenAI 等模型
+
+    LangChain 生成的 llm_string 已经包含模型参数以及 bind_tools 传入的 tools/tool_choice，
+    prompt 是序列化后的消息列表，两者一起组成缓存键。
+    只有 temperature=0 的调用会读写缓存，采样调用每次都请求服务端。
+    """
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _deterministic(llm_string: str) -> bool:
+        """
+        llm_string 由序列化的模型参数和调用参数组成，用 "---" 分隔。
+        调用时传入的 temperature 优先；没有设置 temperature 时服务端会采样，不缓存
+        """
+        head, _, params = llm_string.partition("---")
+        match = _CALL_TEMPERATURE.search(params)
+        if match:
+            temperature = match.group(1)
+        else:
+            try:
+                temperature = json.loads(head).get("kwargs", {}).get("temperature")
+            except (ValueError, AttributeError):
+                return False
+        try:
+            return temperature is not None and float(temperature) == 0
+        except (TypeError, ValueError):
+            return False
+
+    def lookup(self, prompt: str, llm_string: str):
+        if not self._deterministic(llm_string):
+            return None
+        value = self.cache.get(self._key(prompt, llm_string))
+        if value is None:
+            return None
+        from langchain_core.load import loads
+
+        # loads 仍标记为 beta，每次命中都会打印一条警告
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=r"The function `loads` is in beta")
+            return loads(value)
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        if not self._deterministic(llm_string):
+            return
+        from langchain_core.load import dumps
+
+        self.cache.set(self._key(prompt, llm_string), dumps(return_val))
+
+    def clear(self, **kwargs: Any):
+        self.cache.clear()
+
+
+class ExtractionCache:
+    """
+    按分块内容缓存提取结果，文档重新运行时只有内容变化的分块需要请求模型
+
+    Args:
+        schema: 提取用的 pydantic 模型，它的 tool schema 哈希作为 schema 版本
+        version: 额外的版本信息，例如模型名和提示词，变化后旧结果不再命中
+        cache: 底层存储，默认是 config["cacheDir"]/extraction 目录下的 ResponseCache
+    """
+
+    def __init__(self, schema, version: str = "", cache: Optional[ResponseCache] = None):
+        from tool_schema import openai_tool
+
+        raw = json.dumps(openai_tool(schema), sort_keys=True, ensure_ascii=False) + "\n" + version
+        self.schemaVersion = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+        self.cache = cache or ResponseCache(cacheDir=os.path.join(config["cacheDir"], "extraction"))
+
+    def key(self, chunk: str) -> str:
+        return hashlib.sha256(f"{self.schemaVersion}\n{chunk}".encode("utf-8")).hexdigest()
+
+    def get(self, chunk: str) -> Optional[Any]:
+        return self.cache.get(self.key(chunk))
+
+    def set(self, chunk: str, value: Any):
+        self.cache.set(self.key(chunk), value)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+_default_cache: Optional[ResponseCache] = None
+
+
+def default_response_cache() -> ResponseCache:
+    """进程内共享的缓存实例，磁盘目录来自 config["cacheDir"]"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache(cacheDir=config["cacheDir"])
+    return _default_cache
+
+
+def enable_langchain_cache(cache: Optional[ResponseCache] = None) -> ResponseCache:
+    """
+    为所有 LangChain 聊天模型开启全局缓存，返回底层的 ResponseCache 方便查看命中统计。
+    只有 temperature=0 的模型会命中缓存，采样的模型不受影响
+    """
+    cache = cache or default_response_cache()
+    set_llm_cache(LangChainResponseCache(cache))
+    return cache
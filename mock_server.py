@@ -0,0 +1,263 @@
+"""
+本地 OpenAI 兼容的模拟服务，用来在离线环境下替代 config["baseUrl"] 做压测
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才能保持 keep-alive，连接池复用的效果才能体现出来
+    protocol_version = "HTTP/1.1"
+    # 头和body分两次写出，不关Nagle的话keep-alive连接上每个响应会多出约40ms的延迟确认
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server: "MockLLMServer" = self.server.mock
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        server.record_request(body)
+        time.sleep(server.next_latency())
+        if body.get("stream"):
+            self._send_stream(server.build_chunks(body), server.tokenDelay)
+        else:
+            self._send_json(200, server.build_completion(body))
+
+    def _send_stream(self, chunks, token_delay: float):
+        # SSE: 每个数据块一个 "data: {...}" 事件，使用分块传输编码逐个推送
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                time.sleep(token_delay)
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data: dict):
+        raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        # 压测时不打印访问日志
+        pass
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的 listen backlog 只有 5，并发压测时会出现连接被拒绝
+    request_queue_size = 256
+
+
+class MockLLMServer:
+    """
+    在后台线程中运行的模拟 /chat/completions 服务
+
+    Args:
+        latency: 返回第一个字节前的基础等待时间（秒）
+        jitter: 在 latency 上叠加 [0, jitter) 的随机等待
+        reply: 回复文本，也可以是 (请求body) -> 回复文本 的函数
+        tokenDelay: 流式响应中相邻数据块的间隔
+        toolArguments: {工具名: 参数 或 (请求body) -> 参数 的函数}，没有配置的工具按参数的 JSON Schema 生成默认值
+
+    请求里带了 tools 时：tool_choice 指定了函数、或者最后一条消息不是工具结果，就返回一次工具调用，
+    否则返回普通文本，这样 agent 循环在一轮工具调用后就会结束。
+    alwaysCallTools 为 True 时，除非 tool_choice 是 "none"，否则一直返回工具调用，模拟停不下来的模型；
+    toolCallsPerReply 指定一次回复里的工具调用个数
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, reply="This is a mock reply.", tokenDelay=0.0,
+                 jitter=0.0, toolArguments=None, alwaysCallTools=False,
+                 toolCallsPerReply=1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.tokenDelay = tokenDelay
+        self.toolArguments = toolArguments or {}
+        self.alwaysCallTools = alwaysCallTools
+        self.toolCallsPerReply = toolCallsPerReply
+        self.reply = reply
+        self.requestCount = 0
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def baseUrl(self) -> str:
+        return f"http://{self.host}:{self.port}/llmproxy"
+
+    def start(self) -> str:
+        self._httpd = _MockHTTPServer((self.host, self.port), _MockHandler)
+        self._httpd.mock = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.baseUrl
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def record_request(self, body: dict):
+        with self._lock:
+            self.requestCount += 1
+
+    def next_latency(self) -> float:
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def reply_text(self, body: dict) -> str:
+        return self.reply(body) if callable(self.reply) else self.reply
+
+    def build_tool_calls(self, body: dict):
+        """这次回复的工具调用列表，不调用工具时返回 None"""
+        tool_call = self.build_tool_call(body)
+        if tool_call is None:
+            return None
+        return [{**tool_call, "id": f"{tool_call['id']}_{i}"} if i else tool_call
+                for i in range(self.toolCallsPerReply)]
+
+    def build_completion(self, body: dict) -> dict:
+        tool_calls = self.build_tool_calls(body)
+        if tool_calls is not None:
+            message = {"role": "assistant", "content": None, "tool_calls": tool_calls}
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": self.reply_text(body)}
+            finish_reason = "stop"
+        content = message["content"] or ""
+        prompt_tokens = sum(len(str(m.get("content") or "")) // 4 for m in body.get("messages", []))
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-mock-{self.requestCount}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": finish_reason,
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def build_tool_call(self, body: dict):
+        tools = body.get("tools") or []
+        if not tools:
+            return None
+        tool_choice = body.get("tool_choice")
+        messages = body.get("messages") or []
+        if isinstance(tool_choice, dict):
+            name = tool_choice["function"]["name"]
+        elif tool_choice == "none" or (not self.alwaysCallTools and messages and messages[-1].get("role") == "tool"):
+            return None
+        else:
+            name = tools[0]["function"]["name"]
+
+        function = next(tool["function"] for tool in tools if tool["function"]["name"] == name)
+        arguments = self.toolArguments.get(name)
+        if callable(arguments):
+            arguments = arguments(body)
+        if arguments is None:
+            arguments = _default_arguments(function.get("parameters") or {})
+        return {
+            "id": f"call_mock_{self.requestCount}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+        }
+
+    def build_chunks(self, body: dict) -> list[dict]:
+        """
+        把回复切分成 chat.completion.chunk 列表：文本按单词切分；
+        工具调用和 OpenAI 一样，第一个数据块带 id 和函数名，参数字符串分成多个增量
+        """
+        base = {
+            "id": f"chatcmpl-mock-{self.requestCount}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+        }
+        tool_calls = self.build_tool_calls(body)
+        if tool_calls is None:
+            deltas = [{"role": "assistant", "content": ""}]
+            deltas += [{"content": token} for token in re.findall(r"\S+\s*", self.reply_text(body))]
+            finish_reason = "stop"
+        else:
+            deltas = [{"role": "assistant", "content": None}]
+            for index, tool_call in enumerate(tool_calls):
+                function = tool_call["function"]
+                deltas.append({"tool_calls": [{"index": index, "id": tool_call["id"], "type": "function",
+                                               "function": {"name": function["name"], "arguments": ""}}]})
+                arguments = function["arguments"]
+                deltas += [{"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + 8]}}]}
+                           for i in range(0, len(arguments), 8)]
+            finish_reason = "tool_calls"
+        chunks = [{**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                  for delta in deltas]
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+        return chunks
+
+
+def _default_arguments(schema: dict):
+    """按 JSON Schema 生成一份最简单的合法参数"""
+    schema_type = schema.get("type")
+    if "default" in schema:
+        return schema["default"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return _default_arguments(schema["anyOf"][0])
+    if schema_type == "object" or "properties" in schema:
+        return {name: _default_arguments(prop) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return []
+    if schema_type in ("integer", "number"):
+        return 0
+    if schema_type == "boolean":
+        return False
+    if schema_type == "null":
+        return None
+    return "mock"
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的模拟服务")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--latency", type=float, default=0.0)
+    arg_parser.add_argument("--jitter", type=float, default=0.0)
+    arg_parser.add_argument("--token-delay", type=float, default=0.0)
+    arg_parser.add_argument("--reply", default="This is a mock reply.")
+    args = arg_parser.parse_args()
+
+    with MockLLMServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                       tokenDelay=args.token_delay, reply=args.reply) as mock:
+        print(f"mock server listening on {mock.baseUrl}")
+        threading.Event().wait()
@@ -0,0 +1,264 @@
+"""
+进程内共享的模型实例和 HTTP 客户端：
+- 每个 baseUrl 只创建一个带连接池的同步 httpx 客户端，连接和 TLS 会话在所有模型之间复用；
+  异步连接属于创建它们的事件循环，异步客户端按事件循环分别创建
+- 相同 (baseUrl, model, 参数) 的 ChatOpenAI 只创建一次
+- OpenAI SDK 客户端同样按 (baseUrl, apiKey) 共享，底层也是同一个连接池
+langchain_openai 和 openai 导入很慢，第一次创建实例时才导入
+"""
+import asyncio
+import json
+import threading
+from typing import TYPE_CHECKING, Callable, Optional
+
+import httpx
+
+from config import config
+from http_utils import dispose_async_client, shutdown_connections
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from openai import OpenAI
+
+
+class _Endpoint:
+    def __init__(self, baseUrl: str, poolSize: int, timeout: float):
+        self.baseUrl = baseUrl
+        self.requestCount = 0
+        # 同步请求来自多个线程，不同事件循环的异步请求也可能在不同线程里
+        self._countLock = threading.Lock()
+        limits = httpx.Limits(max_connections=poolSize, max_keepalive_connections=poolSize)
+        hooks = {"request": [self._count]}
+        self.client = httpx.Client(limits=limits, timeout=httpx.Timeout(timeout), event_hooks=hooks)
+        self.asyncClient = LoopLocalAsyncClient(
+            lambda: httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(timeout),
+                                      event_hooks={"request": [self._acount]}),
+            timeout=httpx.Timeout(timeout))
+
+    def _count(self, request: httpx.Request):
+        with self._countLock:
+            self.requestCount += 1
+
+    async def _acount(self, request: httpx.Request):
+        self._count(request)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requestCount,
+            "sync": _pool_stats(self.client),
+            "async": _merge_pool_stats([_pool_stats(client) for client in self.asyncClient.clients()]),
+        }
+
+
+class LoopLocalAsyncClient(httpx.AsyncClient):
+    """
+    交给 ChatOpenAI 的异步客户端：自己不建立连接，send 转发给当前事件循环专属的客户端，第一次在某个循环里发请求时才创建。
+    共享的模型实例在多次 asyncio.run 之间使用时，不会复用已经关闭的事件循环里的连接
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncClient], **kwargs):
+        # 自己不发请求，给一个空的 transport，也不读取代理环境变量，避免创建用不到的连接池
+        super().__init__(transport=httpx.AsyncBaseTransport(), trust_env=False, **kwargs)
+        self._factory = factory
+        # id(事件循环) -> (事件循环, 客户端)
+        self._clients: dict[int, tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+        self._lock = threading.Lock()
+
+    def current(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._clients.get(id(loop))
+            if entry is not None and entry[0] is loop:
+                return entry[1]
+            # 顺便清理已经关闭的事件循环留下的客户端
+            stale = [entry for entry in self._clients.values() if entry[0].is_closed()]
+            for stale_loop, _ in stale:
+                del self._clients[id(stale_loop)]
+            client = self._clients[id(loop)] = (loop, self._factory())
+        for stale_loop, stale_client in stale:
+            dispose_async_client(stale_client, stale_loop)
+        return client[1]
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await self.current().send(request, **kwargs)
+
+    def clients(self) -> list[httpx.AsyncClient]:
+        with self._lock:
+            return [client for _, client in self._clients.values()]
+
+    def close_all(self):
+        """在事件循环外关闭所有客户端：循环还在运行的交给循环关闭，已经关闭的直接断开连接"""
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for loop, client in entries:
+            if not dispose_async_client(client, loop):
+                shutdown_connections(client)
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for client_loop, client in entries:
+            if client_loop is loop:
+                await client.aclose()
+            elif not dispose_async_client(client, client_loop):
+                shutdown_connections(client)
+        await super().aclose()
+
+
+def _pool_stats(client) -> dict:
+    """
+    httpx 没有公开连接池状态，这里读取 httpcore 连接池的私有字段，只是尽力而为：
+    httpx/httpcore 升级后字段不存在时返回空的统计，不影响请求
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    try:
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+    except Exception:
+        connections, idle = [], 0
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "maxConnections": getattr(pool, "_max_connections", None),
+    }
+
+
+def _merge_pool_stats(stats: list[dict]) -> dict:
+    """多个事件循环的异步连接池合计"""
+    return {
+        "clients": len(stats),
+        "connections": sum(item["connections"] for item in stats),
+        "idle": sum(item["idle"] for item in stats),
+        "active": sum(item["active"] for item in stats),
+        "maxConnections": stats[0]["maxConnections"] if stats else None,
+    }
+
+
+class ModelRegistry:
+    """
+    Args:
+        poolSize: 每个 baseUrl 的连接池大小，默认读取 config["poolSize"]
+        timeout: 请求超时时间（秒），默认读取 config["timeout"]
+    """
+
+    def __init__(self, poolSize=None, timeout=None):
+        self.poolSize = poolSize or config["poolSize"]
+        self.timeout = timeout or config["timeout"]
+        self._endpoints: dict[str, _Endpoint] = {}
+        self._models: dict[tuple, "ChatOpenAI"] = {}
+        self._openaiClients: dict[tuple, "OpenAI"] = {}
+        self._lock = threading.Lock()
+
+    def endpoint(self, baseUrl: Optional[str] = None) -> _Endpoint:
+        baseUrl = baseUrl or config["baseUrl"]
+        with self._lock:
+            endpoint = self._endpoints.get(baseUrl)
+            if endpoint is None:
+                endpoint = self._endpoints[baseUrl] = _Endpoint(baseUrl, self.poolSize, self.timeout)
+            return endpoint
+
+    def chat_model(self, model=None, baseUrl=None, apiKey=None, **params) -> "ChatOpenAI":
+        """
+        返回共享的 ChatOpenAI，params 是 ChatOpenAI 的其余参数（temperature、cache……）。
+        baseUrl/model/apiKey 不传时在调用时读取 config，修改 config 后会拿到新的实例
+        """
+        model = model or config["model"]
+        baseUrl = baseUrl or config["baseUrl"]
+        apiKey = apiKey or config["apiKey"]
+        key = (baseUrl, model, apiKey, json.dumps(params, sort_keys=True, default=repr))
+        with self._lock:
+            llm = self._models.get(key)
+        if llm is not None:
+            return llm
+
+        from langchain_openai import ChatOpenAI
+
+        endpoint = self.endpoint(baseUrl)
+        llm = ChatOpenAI(model=model, base_url=baseUrl, api_key=apiKey,
+                         http_client=endpoint.client, http_async_client=endpoint.asyncClient, **params)
+        with self._lock:
+            # 并发创建时以先放进去的为准
+            return self._models.setdefault(key, llm)
+
+    def openai_client(self, baseUrl=None, apiKey=None) -> "OpenAI":
+        baseUrl = baseUrl or config["baseUrl"]
+        apiKey = apiKey or config["apiKey"]
+        key = (baseUrl, apiKey)
+        with self._lock:
+            client = self._openaiClients.get(key)
+        if client is not None:
+            return client
+
+        from openai import OpenAI
+
+        client = OpenAI(api_key=apiKey, base_url=baseUrl, http_client=self.endpoint(baseUrl).client)
+        with self._lock:
+            return self._openaiClients.setdefault(key, client)
+
+    def stats(self) -> dict:
+        """每个 baseUrl 的请求数和连接池状态，以及共享的模型实例数"""
+        with self._lock:
+            endpoints = dict(self._endpoints)
+            models, clients = len(self._models), len(self._openaiClients)
+        return {
+            "models": models,
+            "openaiClients": clients,
+            "endpoints": {baseUrl: endpoint.stats() for baseUrl, endpoint in endpoints.items()},
+        }
+
+    def close(self):
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            models = list(self._models.values())
+            self._endpoints.clear()
+            self._models.clear()
+            self._openaiClients.clear()
+        # 已经绑定了工具的模型用的是要关闭的客户端，一并从缓存里去掉；tool_schema 导入较慢，关闭时才导入
+        from tool_schema import forget_models
+        forget_models(models)
+        for endpoint in endpoints:
+            endpoint.client.close()
+            endpoint.asyncClient.close_all()
+
+    async def aclose(self):
+        """在事件循环里调用，当前循环的异步客户端会等待连接关闭完成"""
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            models = list(self._models.values())
+            self._endpoints.clear()
+            self._models.clear()
+            self._openaiClients.clear()
+        # 已经绑定了工具的模型用的是要关闭的客户端，一并从缓存里去掉；tool_schema 导入较慢，关闭时才导入
+        from tool_schema import forget_models
+        forget_models(models)
+        for endpoint in endpoints:
+            endpoint.client.close()
+            await endpoint.asyncClient.aclose()
+
+
+_default_registry: Optional[ModelRegistry] = None
+_default_lock = threading.Lock()
+
+
+def default_registry() -> ModelRegistry:
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry()
+        return _default_registry
+
+
+def get_chat_model(model=None, baseUrl=None, apiKey=None, **params) -> "ChatOpenAI":
+    return default_registry().chat_model(model, baseUrl, apiKey, **params)
+
+
+def get_openai_client(baseUrl=None, apiKey=None) -> "OpenAI":
+    return default_registry().openai_client(baseUrl, apiKey)
+
+
+def pool_stats() -> dict:
+    return default_registry().stats()
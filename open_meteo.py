@@ -0,0 +1,82 @@
+"""
+Open-Meteo 逐小时温度预报：按经纬度网格缓存预报，用二分查找定位最接近当前时间的小时
+"""
+import datetime
+from array import array
+from bisect import bisect_left
+
+import requests
+
+from config import config
+from ttl_cache import TTLCache
+
+BASE_URL = "https://api.open-meteo.com/v1/forecast"
+# 网格精度（小数位数），0.1 度约 11 公里，同一网格内的位置共用一份预报
+GRID_DIGITS = 1
+# 预报按小时更新，缓存 15 分钟
+_forecast_cache = TTLCache(maxsize=512, ttl=15 * 60)
+_session = requests.Session()
+
+
+class Forecast:
+    """逐小时预报，times 是升序排列的 UTC 时间戳（秒）"""
+
+    def __init__(self, times, temperatures):
+        order = sorted(range(len(times)), key=times.__getitem__)
+        self.times = array("d", (times[i] for i in order))
+        self.temperatures = [temperatures[i] for i in order]
+
+    @classmethod
+    def from_response(cls, results: dict) -> "Forecast":
+        times = []
+        for time_str in results['hourly']['time']:
+            moment = datetime.datetime.fromisoformat(time_str.replace('Z', '+00:00'))
+            # Open-Meteo 默认返回不带时区的 GMT 时间
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=datetime.timezone.utc)
+            times.append(moment.timestamp())
+        return cls(times, results['hourly']['temperature_2m'])
+
+    def nearest_temperature(self, moment: datetime.datetime) -> float:
+        """O(log n) 找到离 moment 最近的整点温度"""
+        if not self.times:
+            raise ValueError("forecast is empty")
+        target = moment.timestamp()
+        i = bisect_left(self.times, target)
+        if i == len(self.times):
+            i -= 1
+        elif i > 0 and target - self.times[i - 1] <= self.times[i] - target:
+            i -= 1
+        return self.temperatures[i]
+
+
+def grid_cell(latitude: float, longitude: float) -> tuple[float, float]:
+    return round(latitude, GRID_DIGITS), round(longitude, GRID_DIGITS)
+
+
+def get_forecast(latitude: float, longitude: float) -> Forecast:
+    """获取坐标所在网格的预报，缓存有效期内不发请求"""
+    cell = grid_cell(latitude, longitude)
+    forecast = _forecast_cache.get(cell)
+    if forecast is not None:
+        return forecast
+
+    # 请求网格中心点，保证同一网格内缓存的预报是一致的
+    params = {
+        'latitude': cell[0],
+        'longitude': cell[1],
+        'hourly': 'temperature_2m',
+        'forecast_days': 1,
+    }
+    response = _session.get(BASE_URL, params=params, timeout=config["timeout"])
+    if response.status_code != 200:
+        raise Exception(f"API Request failed with status code: {response.status_code}")
+
+    forecast = Forecast.from_response(response.json())
+    _forecast_cache.set(cell, forecast)
+    return forecast
+
+
+def current_temperature(latitude: float, longitude: float) -> float:
+    forecast = get_forecast(latitude, longitude)
+    return forecast.nearest_temperature(datetime.datetime.now(datetime.timezone.utc))
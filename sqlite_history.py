@@ -0,0 +1,175 @@
+"""
+基于 SQLite（WAL 模式）的会话历史存储，用来替代进程内的 Dict[str, ChatMessageHistory]：
+- 消息只追加写入，批量提交；后台线程每隔 flushInterval 提交一次，进程退出时也会提交，
+  忘了调用 close 或者之后没有新的写入时，待写入的消息不会丢
+- 内存中只保留最近活跃的会话（LRU），空闲超时的会话会被移出内存
+"""
+import atexit
+import functools
+import json
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from config import config
+
+
+class SQLiteHistoryStore:
+    def __init__(self, path=None, maxHotSessions=1024, idleSeconds=600, batchSize=256, flushInterval=1.0):
+        self.path = path or config["historyDb"]
+        self.maxHotSessions = maxHotSessions
+        self.idleSeconds = idleSeconds
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 只在检查点时 fsync，追加写入不会每次落盘
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            message TEXT NOT NULL
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, id)")
+        self._conn.commit()
+
+        # session_id -> (消息列表, 最近访问时间)，按访问顺序排列
+        self._hot: OrderedDict[str, tuple[list[BaseMessage], float]] = OrderedDict()
+        # 尚未写入数据库的 (session_id, 序列化后的消息)
+        self._pending: list[tuple[str, str]] = []
+        self._lastFlush = time.monotonic()
+        self._lock = threading.RLock()
+
+        # 后台线程和 atexit 只持有弱引用，不影响 store 被回收
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=_flush_periodically,
+                                         args=(weakref.ref(self), self._closed, flushInterval),
+                                         name="sqlite-history-flush", daemon=True)
+        self._flusher.start()
+        self._atexit = functools.partial(_flush_at_exit, weakref.ref(self))
+        atexit.register(self._atexit)
+
+    def get_session_history(self, session_id: str) -> "SQLiteChatMessageHistory":
+        """可以直接作为 RunnableWithMessageHistory 的 get_session_history 参数"""
+        return SQLiteChatMessageHistory(session_id, self)
+
+    def load(self, session_id: str) -> list[BaseMessage]:
+        with self._lock:
+            item = self._hot.get(session_id)
+            if item is None:
+                # 先把待写入的消息提交，保证查到的是完整历史
+                self.flush()
+                rows = self._conn.execute(
+                    "SELECT message FROM chat_messages WHERE session_id = ? ORDER BY id", (session_id,)
+                ).fetchall()
+                messages = messages_from_dict([json.loads(row[0]) for row in rows])
+            else:
+                messages = item[0]
+            self._put_hot(session_id, messages)
+            return list(messages)
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        with self._lock:
+            item = self._hot.get(session_id)
+            # 不在内存里的会话只写库，下次读取时再整体加载
+            if item is not None:
+                item[0].extend(messages)
+                self._put_hot(session_id, item[0])
+            self._pending.extend((session_id, json.dumps(message_to_dict(message), ensure_ascii=False))
+                                 for message in messages)
+            if len(self._pending) >= self.batchSize or time.monotonic() - self._lastFlush >= self.flushInterval:
+                self.flush()
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self.flush()
+            self._conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+            self._hot.pop(session_id, None)
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                with self._conn:
+                    self._conn.executemany("INSERT INTO chat_messages (session_id, message) VALUES (?, ?)",
+                                           self._pending)
+                self._pending = []
+            self._lastFlush = time.monotonic()
+            self.evict_idle()
+
+    def _flush_if_due(self):
+        with self._lock:
+            if self._closed.is_set():
+                return
+            if self._pending and time.monotonic() - self._lastFlush >= self.flushInterval:
+                self.flush()
+
+    def evict_idle(self):
+        """移出空闲超时的会话，_hot 按访问时间排序，只需要从头检查"""
+        deadline = time.monotonic() - self.idleSeconds
+        with self._lock:
+            while self._hot:
+                session_id, (_, last_access) = next(iter(self._hot.items()))
+                if last_access > deadline:
+                    break
+                self._hot.popitem(last=False)
+
+    def close(self):
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            atexit.unregister(self._atexit)
+            self.flush()
+            self._conn.close()
+
+    @property
+    def hotSessions(self) -> int:
+        return len(self._hot)
+
+    def _put_hot(self, session_id: str, messages: list[BaseMessage]):
+        self._hot[session_id] = (messages, time.monotonic())
+        self._hot.move_to_end(session_id)
+        while len(self._hot) > self.maxHotSessions:
+            self._hot.popitem(last=False)
+
+
+def _flush_periodically(ref: "weakref.ref[SQLiteHistoryStore]", closed: threading.Event, interval: float):
+    """追加之后一直没有新的写入时，待写入的消息最多等 interval 秒就提交"""
+    while not closed.wait(interval):
+        store = ref()
+        if store is None:
+            return
+        store._flush_if_due()
+        del store
+
+
+def _flush_at_exit(ref: "weakref.ref[SQLiteHistoryStore]"):
+    store = ref()
+    if store is not None:
+        store.close()
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """单个会话的历史，实际读写都交给共享的 SQLiteHistoryStore"""
+
+    def __init__(self, session_id: str, store: Optional[SQLiteHistoryStore] = None):
+        self.session_id = session_id
+        self.store = store or SQLiteHistoryStore()
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.store.load(self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
@@ -0,0 +1,204 @@
+"""
+流式结构化输出解析：逐个消费模型返回的增量文本，每个字符只扫描一次，
+顶层 JSON 对象的某个字段值一闭合就解析并返回，不需要等整个回复生成完，也不会反复解析越来越长的缓冲区
+"""
+import json
+from typing import Annotated, Any, Iterable, Iterator, Type
+
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+# 解析状态
+_SEEK = 0          # 还没遇到顶层的 {，跳过 ```json 之类的前缀
+_KEY_OR_END = 1    # 等待字段名或 }
+_KEY = 2           # 在字段名字符串里
+_COLON = 3         # 等待 :
+_VALUE_START = 4   # 等待字段值的第一个字符
+_VALUE = 5         # 在字段值里
+_AFTER_VALUE = 6   # 等待 , 或 }
+_DONE = 7
+
+
+class IncrementalJSONObjectParser:
+    """增量解析一个顶层 JSON 对象，feed 返回这次新闭合的 (字段名, 值)"""
+
+    def __init__(self):
+        self.state = _SEEK
+        self._key: list[str] = []
+        self._currentKey = ""
+        self._value: list[str] = []
+        self._kind = ""  # 当前值的类型: string / container / literal
+        self._depth = 0
+        self._inString = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self.state == _DONE
+
+    def feed(self, text: str) -> list[tuple[str, Any]]:
+        completed = []
+        for ch in text:
+            state = self.state
+            if state == _VALUE:
+                if self._consume_value(ch):
+                    completed.append(self._emit())
+                    self.state = _AFTER_VALUE
+                    if self._kind == "literal":
+                        # 数字、true/false/null 没有结束符，读到的分隔符也要处理
+                        self._after_value(ch)
+            elif state == _KEY:
+                if self._escape:
+                    self._escape = False
+                    self._key.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    self._key.append(ch)
+                elif ch == '"':
+                    self._currentKey = json.loads('"' + "".join(self._key) + '"')
+                    self._key = []
+                    self.state = _COLON
+                else:
+                    self._key.append(ch)
+            elif state == _SEEK:
+                if ch == "{":
+                    self.state = _KEY_OR_END
+            elif ch.isspace():
+                continue
+            elif state == _KEY_OR_END:
+                if ch == '"':
+                    self.state = _KEY
+                elif ch == "}":
+                    self.state = _DONE
+                elif ch != ",":
+                    raise OutputParserException(f"Expected a key, got {ch!r}")
+            elif state == _COLON:
+                if ch != ":":
+                    raise OutputParserException(f"Expected ':' after key {self._currentKey!r}, got {ch!r}")
+                self.state = _VALUE_START
+            elif state == _VALUE_START:
+                self._start_value(ch)
+            elif state == _AFTER_VALUE:
+                self._after_value(ch)
+            # _DONE 之后的文本（例如结尾的 ```）忽略
+        return completed
+
+    def _start_value(self, ch: str):
+        self._value = [ch]
+        self._inString = self._escape = False
+        if ch == '"':
+            self._kind, self._inString = "string", True
+        elif ch in "{[":
+            self._kind, self._depth = "container", 1
+        else:
+            self._kind = "literal"
+        self.state = _VALUE
+
+    def _consume_value(self, ch: str) -> bool:
+        """把 ch 加进当前值，返回值是否已经结束"""
+        if self._kind == "literal":
+            if ch in ",}" or ch.isspace():
+                return True
+            self._value.append(ch)
+            return False
+
+        self._value.append(ch)
+        if self._inString:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._inString = False
+                return self._kind == "string"
+            return False
+        if ch == '"':
+            self._inString = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            return self._depth == 0
+        return False
+
+    def _after_value(self, ch: str):
+        if ch == ",":
+            self.state = _KEY_OR_END
+        elif ch == "}":
+            self.state = _DONE
+        elif not ch.isspace():
+            raise OutputParserException(f"Expected ',' or '}}' after {self._currentKey!r}, got {ch!r}")
+
+    def _emit(self) -> tuple[str, Any]:
+        raw = "".join(self._value)
+        self._value = []
+        try:
+            return self._currentKey, json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise OutputParserException(f"Invalid value for {self._currentKey!r}: {raw}") from e
+
+
+class StreamingPydanticParser:
+    """
+    PydanticOutputParser 的流式版本：feed 返回新完成并通过校验的 (字段名, 值)，
+    全部文本消费完后 finish 返回完整的模型对象
+
+    JSON 里的键可以是字段名或别名，返回的始终是字段名。单个字段按模型本身校验（Field 约束和字段校验器都生效）；
+    模型有 model_validator 时，只有部分字段的模型不一定能通过它，这时只按字段的类型和 Field 约束校验
+    """
+
+    def __init__(self, pydantic_object: Type[BaseModel]):
+        self.pydantic_object = pydantic_object
+        # JSON 键 -> 字段名
+        self._names: dict[str, str] = {}
+        for name, field in pydantic_object.model_fields.items():
+            self._names[name] = name
+            for alias in (field.alias, field.validation_alias):
+                if isinstance(alias, str):
+                    self._names[alias] = name
+        self._partial = None
+        self._adapters: dict[str, TypeAdapter] = {}
+        if pydantic_object.__pydantic_decorators__.model_validators:
+            self._adapters = {name: TypeAdapter(Annotated[(field.annotation, *field.metadata)])
+                              if field.metadata else TypeAdapter(field.annotation)
+                              for name, field in pydantic_object.model_fields.items()}
+        else:
+            # 逐个字段赋值校验的空模型对象，字段校验器能通过 info.data 看到前面已经完成的字段
+            self._partial = pydantic_object.model_construct()
+        self._json = IncrementalJSONObjectParser()
+        self.values: dict[str, Any] = {}
+        # 原始的 JSON 键和值，finish 时整体校验，别名和 before 校验器都按原样处理
+        self._raw: dict[str, Any] = {}
+
+    def _validate_field(self, name: str, value: Any) -> Any:
+        if self._partial is None:
+            return self._adapters[name].validate_python(value)
+        self.pydantic_object.__pydantic_validator__.validate_assignment(self._partial, name, value)
+        return getattr(self._partial, name)
+
+    def feed(self, delta: str) -> list[tuple[str, Any]]:
+        fields = []
+        for key, value in self._json.feed(delta):
+            name = self._names.get(key)
+            if name is None:
+                continue
+            self._raw[key] = value
+            try:
+                value = self._validate_field(name, value)
+            except ValidationError as e:
+                raise OutputParserException(f"Invalid field {key!r}: {e}") from e
+            self.values[name] = value
+            fields.append((name, value))
+        return fields
+
+    def parse_stream(self, deltas: Iterable[str]) -> Iterator[tuple[str, Any]]:
+        for delta in deltas:
+            yield from self.feed(delta)
+
+    def finish(self) -> BaseModel:
+        if not self._json.done:
+            raise OutputParserException(f"Incomplete JSON object, parsed fields: {list(self.values)}")
+        try:
+            return self.pydantic_object.model_validate(self._raw)
+        except ValidationError as e:
+            raise OutputParserException(f"Failed to parse {self.pydantic_object.__name__}: {e}") from e
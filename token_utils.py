@@ -0,0 +1,37 @@
+"""
+token 计数：使用 tiktoken 的 cl100k_base 编码近似模型的分词。
+tiktoken 第一次加载编码时要联网下载词表，离线环境需要提前下载并设置 TIKTOKEN_CACHE_DIR 指向缓存目录，
+加载失败时退回按字符估算
+"""
+import warnings
+from functools import lru_cache
+
+_encoding = None
+
+
+class _ApproxEncoding:
+    """加载不了 tiktoken 编码时的估算：非 ASCII 字符（如中文）每个算一个 token，ASCII 字符每 4 个算一个"""
+
+    @staticmethod
+    def encode(text: str) -> range:
+        non_ascii = sum(1 for ch in text if ord(ch) > 127)
+        return range(non_ascii + (len(text) - non_ascii + 3) // 4)
+
+
+def count_tokens(text: str) -> int:
+    """用 tiktoken 统计 token 数，编码器只加载一次"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            warnings.warn(f"无法加载 tiktoken 编码，改用近似计数: {e!r}")
+            _encoding = _ApproxEncoding()
+    return len(_encoding.encode(text))
+
+
+@lru_cache(maxsize=8192)
+def cached_count_tokens(text: str) -> int:
+    """带缓存的 count_tokens，文本分割时同一片段会被反复计数"""
+    return count_tokens(text)
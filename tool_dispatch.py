@@ -0,0 +1,140 @@
+"""
+工具调度器：接在模型 / 解析器后面的 Runnable，名字到工具的映射在创建时建好，
+执行一条消息里的全部工具调用；batch/abatch 把所有输入的工具调用摊平后并发执行，
+同时执行的工具数不超过 maxConcurrency
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Sequence
+
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from concurrent_utils import imap_bounded
+
+
+class ToolDispatcher(Runnable):
+    """
+    输入可以是 AgentFinish、AgentAction、AgentAction 列表或带 tool_calls 的 AIMessage：
+    - 没有工具调用时返回最终回答的文本
+    - 有工具调用时按调用顺序返回每个工具的结果列表，只有一个工具调用时也是列表
+    - 调用了不存在的工具时，对应位置是错误信息，同一个输入里的其他工具照常执行（和 BudgetedAgentExecutor 一致）
+
+    Args:
+        tools: 工具列表
+        maxConcurrency: 同时执行的工具数上限，config 里的 max_concurrency 更小时以它为准
+    """
+
+    def __init__(self, tools: Sequence, maxConcurrency=16):
+        self.toolMap = {tool.name: tool for tool in tools}
+        self.maxConcurrency = maxConcurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.maxConcurrency)
+        return self._executor
+
+    def _calls(self, input) -> tuple[Optional[str], list[tuple[str, Any]]]:
+        """返回 (最终回答, [(工具名, 参数)])，两者只有一个有值"""
+        if isinstance(input, AgentFinish):
+            return input.return_values["output"], []
+        if isinstance(input, AgentAction):
+            input = [input]
+        if isinstance(input, AIMessage):
+            if not input.tool_calls:
+                return input.content, []
+            calls = [(tool_call["name"], tool_call["args"]) for tool_call in input.tool_calls]
+        else:
+            calls = [(action.tool, action.tool_input) for action in input]
+        return None, calls
+
+    def _limit(self, config: Optional[RunnableConfig]) -> int:
+        # 同步和异步都不超过线程池的大小
+        return min((config or {}).get("max_concurrency") or self.maxConcurrency, self.maxConcurrency)
+
+    def invoke(self, input, config: Optional[RunnableConfig] = None, **kwargs) -> Any:
+        return self.batch([input], config)[0]
+
+    async def ainvoke(self, input, config: Optional[RunnableConfig] = None, **kwargs) -> Any:
+        return (await self.abatch([input], config))[0]
+
+    def batch(self, inputs: list, config=None, *, return_exceptions: bool = False, **kwargs) -> list:
+        # 每个输入在回调和追踪里是一次 chain 运行，工具的运行挂在它下面
+        return self._batch_with_config(self._batch, inputs, config, return_exceptions=return_exceptions)
+
+    async def abatch(self, inputs: list, config=None, *, return_exceptions: bool = False, **kwargs) -> list:
+        return await self._abatch_with_config(self._abatch, inputs, config, return_exceptions=return_exceptions)
+
+    def _prepare(self, inputs: list) -> tuple[list, list]:
+        """返回 (输出列表, [(输入下标, 调用下标, 工具名, 参数)])，解析失败的输入直接把异常放进输出"""
+        outputs: list[Any] = [None] * len(inputs)
+        flat = []
+        for i, input in enumerate(inputs):
+            try:
+                final, calls = self._calls(input)
+            except Exception as e:
+                outputs[i] = e
+                continue
+            outputs[i] = final if final is not None else [None] * len(calls)
+            for j, (name, args) in enumerate(calls):
+                if name in self.toolMap:
+                    flat.append((i, j, name, args))
+                else:
+                    # 模型调用了不存在的工具，返回错误信息让调用方处理，不中断这个输入
+                    outputs[i][j] = f"工具 {name} 不存在"
+        return outputs, flat
+
+    def _batch(self, inputs: list, config: list[RunnableConfig]) -> list:
+        outputs, flat = self._prepare(inputs)
+
+        def run(call):
+            i, _, name, args = call
+            return self.toolMap[name].invoke(args, config[i])
+
+        for index, future in imap_bounded(run, flat, self._limit(config[0]), self.executor):
+            i, j, _, _ = flat[index]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            self._store(outputs, i, j, result)
+        return outputs
+
+    async def _abatch(self, inputs: list, config: list[RunnableConfig]) -> list:
+        outputs, flat = self._prepare(inputs)
+        semaphore = asyncio.Semaphore(self._limit(config[0]))
+        loop = asyncio.get_running_loop()
+
+        async def run(i, j, name, args):
+            tool = self.toolMap[name]
+            async with semaphore:
+                try:
+                    if getattr(tool, "coroutine", None) is not None:
+                        result = await tool.ainvoke(args, config[i])
+                    else:
+                        # 同步实现的工具放到线程池里，不阻塞事件循环
+                        result = await loop.run_in_executor(self.executor, tool.invoke, args, config[i])
+                except Exception as e:
+                    result = e
+            self._store(outputs, i, j, result)
+
+        await asyncio.gather(*(run(*call) for call in flat))
+        return outputs
+
+    @staticmethod
+    def _store(outputs: list, i: int, j: int, result):
+        """一个输入里任意一个工具失败，这个输入的输出就是第一个异常"""
+        if isinstance(outputs[i], Exception):
+            return
+        if isinstance(result, Exception):
+            outputs[i] = result
+        else:
+            outputs[i][j] = result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
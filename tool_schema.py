@@ -0,0 +1,103 @@
+"""
+工具定义的缓存：pydantic 模型 / @tool 函数转换成 OpenAI tool schema 的结果在进程内只生成一次，
+绑定了工具的模型也按 (模型实例, 工具, 参数) 缓存。
+同一个 schema 字典对象会原样放进每次请求的 tools 参数，序列化出来的内容逐字节相同。
+两个缓存都是有上限的 LRU，不会让每次新建的工具和模型一直留在内存里
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, Sequence
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+MAX_SCHEMAS = 1024
+MAX_BOUND_MODELS = 256
+
+# id(对象) -> (对象, schema)。@tool 生成的工具是不可哈希的 pydantic 对象，只能按 id 做键；
+# 条目里保留对象本身，命中时检查是不是同一个对象，避免对象被回收后 id 被复用
+_schemas: OrderedDict[int, tuple[Any, dict]] = OrderedDict()
+# (模型实例 id, 工具 id..., 参数) -> (模型实例, 工具列表, 绑定后的模型)
+# 绑定后的模型引用着模型实例，弱引用的键永远不会被回收，所以同样用 LRU 限制条目数
+_bound: OrderedDict[tuple, tuple[Any, tuple, Any]] = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def openai_tool(tool) -> dict:
+    """
+    convert_to_openai_tool 的缓存版本。
+    以类或工具对象本身为键，重新定义的类（例如 reload 之后）是新的对象，会重新生成 schema；
+    已经是 OpenAI 格式的字典原样返回
+    """
+    global _hits, _misses
+    if isinstance(tool, dict):
+        return convert_to_openai_tool(tool)
+    with _lock:
+        entry = _schemas.get(id(tool))
+        if entry is not None and entry[0] is tool:
+            _hits += 1
+            _schemas.move_to_end(id(tool))
+            return entry[1]
+    schema = convert_to_openai_tool(tool)
+    with _lock:
+        _misses += 1
+        entry = _schemas.get(id(tool))
+        if entry is None or entry[0] is not tool:
+            entry = _put(_schemas, id(tool), (tool, schema), MAX_SCHEMAS)
+        return entry[1]
+
+
+def bind_tools_cached(llm, tools: Sequence, tool_choice=None, **kwargs):
+    """llm.bind_tools 的缓存版本，相同的模型实例、工具和参数返回同一个绑定后的模型"""
+    global _hits, _misses
+    tools = tuple(tools)
+    key = (id(llm), tuple(id(tool) for tool in tools), json.dumps([tool_choice, kwargs], sort_keys=True, default=repr))
+    with _lock:
+        entry = _bound.get(key)
+        if _same(entry, llm, tools):
+            _hits += 1
+            _bound.move_to_end(key)
+            return entry[2]
+    bound = llm.bind_tools([openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+    with _lock:
+        _misses += 1
+        entry = _bound.get(key)
+        if not _same(entry, llm, tools):
+            entry = _put(_bound, key, (llm, tools, bound), MAX_BOUND_MODELS)
+        return entry[2]
+
+
+def _same(entry, llm, tools: tuple) -> bool:
+    return entry is not None and entry[0] is llm and all(a is b for a, b in zip(entry[1], tools))
+
+
+def _put(cache: OrderedDict, key, entry: tuple, maxSize: int) -> tuple:
+    """放入新条目，超过上限时淘汰最久没用过的"""
+    cache[key] = entry
+    cache.move_to_end(key)
+    while len(cache) > maxSize:
+        cache.popitem(last=False)
+    return entry
+
+
+def forget_models(llms: Iterable):
+    """丢掉这些模型实例绑定出来的缓存，模型所在的注册表关闭时调用"""
+    ids = {id(llm) for llm in llms}
+    with _lock:
+        for key in [key for key, entry in _bound.items() if id(entry[0]) in ids]:
+            del _bound[key]
+
+
+def cache_info() -> dict:
+    with _lock:
+        return {"schemas": len(_schemas), "boundModels": len(_bound), "hits": _hits, "misses": _misses}
+
+
+def clear():
+    global _hits, _misses
+    with _lock:
+        _schemas.clear()
+        _bound.clear()
+        _hits = _misses = 0